@@ -1,8 +1,8 @@
 # Imports
 import os
 from flask import Flask
-from api.config import LocalConfig
-from api.database import db
+from api.config import LocalConfig,TestingConfig,ProductionConfig
+from api.database import db,apply_pragmas
 from flask_bcrypt import Bcrypt
 from flask_login import LoginManager
 
@@ -18,10 +18,12 @@ def create_app():
 
     #Configuring app
     if environment == 'production':
-        raise Exception("No production environment set up yet.")
+        print("Configuring from production environment")
+        app.config.from_object(ProductionConfig)
     
     elif environment == 'testing':
-        raise Exception("No testing environment set up yet.")
+        print("Configuring from testing environment")
+        app.config.from_object(TestingConfig)
     
     elif environment == 'development':
         print("Configuring from local development environment")
@@ -34,9 +36,10 @@ def create_app():
     db.init_app(app)
 
     app.app_context().push()
+    apply_pragmas(db.engine,app.config["SQLITE_PRAGMAS"])
 
-    #Configuring hashing and security
-    bcrypt = Bcrypt()
+    #Configuring hashing and security, see api/passwords.py for the cost and process pool
+    bcrypt = Bcrypt(app)
     return app,bcrypt
 
 #Instantiating app and login manager
@@ -44,4 +47,38 @@ app,bcrypt = create_app()
 login_manager.init_app(app)
 
 #Importing all the routes
-from api import routes
\ No newline at end of file
+from api import routes
+
+#Registering the JSON API
+from api.rest import blueprint as rest_api
+app.register_blueprint(rest_api)
+
+#Serving content hashed static files
+from api import assets
+assets.init_app(app)
+
+#Registering command line tools
+from api import commands
+
+#Turning away requests over their rate or concurrency limits
+from api.limits import install as install_limits
+install_limits(app)
+
+#Failing requests that go over their query budget
+if app.config["QUERY_BUDGET"] is not None:
+    from api.loaders import enforce_query_budget
+    enforce_query_budget(app,db.engine)
+
+#Recording query counts and timings
+if app.config["INSTRUMENTATION"]:
+    from api.instrumentation import instrument
+    instrument(app,db.engine)
+
+#Starting the password hashing pool, if any
+from api.passwords import install as install_passwords
+install_passwords(app)
+
+#Taking the first read replica snapshot
+from api.replica import install as install_replica
+install_replica(app)
+
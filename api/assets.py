@@ -0,0 +1,138 @@
+# Imports
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import shutil
+from flask import current_app,request,send_from_directory,url_for
+
+# Optional, brotli variants are only built when it is installed.
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+## Static asset pipeline. The build-assets command copies every file of the static
+## folder into static/dist under a name carrying a hash of its content, next to gzip and
+## brotli variants, and records the names in a manifest. Templates link assets through
+## asset_url, which picks the hashed name, so they can be cached for a year and a new
+## build simply changes the URLs.
+
+# Folder of the build output, inside the static folder.
+BUILD_DIR = "dist"
+MANIFEST = "manifest.json"
+
+# Files not worth compressing, and the smallest worth it.
+COMPRESSIBLE = (".css",".js",".map",".svg",".html",".txt",".json")
+MIN_COMPRESS_SIZE = 1024
+
+# Precompressed variants in order of preference, as (Content-Encoding,suffix).
+ENCODINGS = [("br",".br"),("gzip",".gz")]
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+# Logical name to hashed name, loaded from the manifest on first use.
+_manifest = None
+
+def _hashed_name(path,digest):
+    root,ext = os.path.splitext(path)
+    return f"{root}.{digest[:12]}{ext}"
+
+def _compress(path):
+    with open(path,"rb") as f:
+        data = f.read()
+    with open(path + ".gz","wb") as f:
+        f.write(gzip.compress(data,compresslevel=9,mtime=0))
+    if brotli is not None:
+        with open(path + ".br","wb") as f:
+            f.write(brotli.compress(data,quality=11))
+
+def build(static_folder,progress = None):
+    """Rebuild static/dist from the static folder and return the new manifest."""
+    out = os.path.join(static_folder,BUILD_DIR)
+    shutil.rmtree(out,ignore_errors=True)
+
+    manifest = {}
+    for folder,dirs,files in os.walk(static_folder):
+        if os.path.abspath(folder) == os.path.abspath(static_folder):
+            dirs[:] = [d for d in dirs if d != BUILD_DIR]
+        for name in sorted(files):
+            source = os.path.join(folder,name)
+            logical = os.path.relpath(source,static_folder).replace(os.sep,"/")
+
+            # Source maps are found through the name written inside the file they map,
+            # so they keep their name.
+            if name.endswith(".map"):
+                target = logical
+            else:
+                with open(source,"rb") as f:
+                    target = _hashed_name(logical,hashlib.sha256(f.read()).hexdigest())
+                manifest[logical] = target
+
+            destination = os.path.join(out,target)
+            os.makedirs(os.path.dirname(destination),exist_ok=True)
+            shutil.copyfile(source,destination)
+            if name.endswith(COMPRESSIBLE) and os.path.getsize(source) >= MIN_COMPRESS_SIZE:
+                _compress(destination)
+            if progress:
+                progress(logical,target)
+
+    with open(os.path.join(out,MANIFEST),"w") as f:
+        json.dump(manifest,f,indent=4,sort_keys=True)
+    reload()
+    return manifest
+
+def manifest():
+    global _manifest
+    if _manifest is None:
+        try:
+            with open(os.path.join(current_app.static_folder,BUILD_DIR,MANIFEST)) as f:
+                _manifest = json.load(f)
+        except FileNotFoundError:
+            _manifest = {}
+    return _manifest
+
+def reload():
+    """Forget the loaded manifest so the next lookup reads it again."""
+    global _manifest
+    _manifest = None
+
+def asset_url(endpoint,**values):
+    """
+        Drop in for url_for. Static files with a built copy link to it, anything else
+        is left to url_for.
+    """
+    if endpoint == "static":
+        hashed = manifest().get(values.get("filename"))
+        if hashed is not None:
+            values["filename"] = hashed
+            return url_for("built_asset",**values)
+    return url_for(endpoint,**values)
+
+def serve_built(filename):
+    """Serve a built asset, precompressed when the client accepts it, cached for good."""
+    folder = os.path.join(current_app.static_folder,BUILD_DIR)
+    mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    accepted = request.accept_encodings
+
+    for encoding,suffix in ENCODINGS:
+        if accepted[encoding] and os.path.isfile(os.path.join(folder,filename + suffix)):
+            response = send_from_directory(folder,filename + suffix,mimetype=mimetype)
+            response.headers["Content-Encoding"] = encoding
+            break
+    else:
+        response = send_from_directory(folder,filename,mimetype=mimetype)
+
+    # Only hashed names are safe to keep forever, source maps keep their name across builds.
+    if filename in manifest().values():
+        response.headers["Cache-Control"] = IMMUTABLE
+    else:
+        response.cache_control.max_age = 0
+    response.vary.add("Accept-Encoding")
+    return response
+
+def init_app(app):
+    """Route built assets through serve_built and give templates asset_url."""
+    app.add_url_rule(f"{app.static_url_path}/{BUILD_DIR}/<path:filename>","built_asset",serve_built)
+    app.add_template_global(asset_url)
@@ -0,0 +1,162 @@
+# Imports
+import json
+import random
+import time
+from api.database import listen_everywhere,remove_everywhere
+from api import app,db
+from api.models import *
+from api import seed
+from api import passwords
+
+## Route level benchmark. Drives the key routes through the Flask test client against
+## whatever database is configured (ideally one filled by the seed command) and reports
+## latency percentiles and query counts per route.
+
+class _QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self,conn,cursor,statement,parameters,context,executemany):
+        self.count += 1
+
+def percentile(samples,p):
+    """Return the p-th percentile of samples by nearest rank."""
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1,max(0,int(round(p / 100 * len(ordered))) - 1))]
+
+def _client_for(user):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session["_user_id"] = str(user.id)
+        session["_fresh"] = True
+    return client
+
+def _scenarios(rng):
+    """Return (name,user,request function) for every benchmarked route."""
+    reader = User.query.filter(User.is_librarian == 0).order_by(User.id).first()
+    librarian = User.query.filter(User.is_librarian == 1).order_by(User.id).first()
+    popular = [id for (id,) in db.session.query(Book.id).order_by(Book.rating_count.desc()).limit(100)]
+    words = [word for name in db.session.query(Book.name).limit(200) for word in name[0].split()[1:3]]
+
+    scenarios = [
+        ("trending",reader,lambda c: c.get("/trending")),
+        ("selected_book",reader,lambda c: c.get(f"/book/{rng.choice(popular)}")),
+        ("search",reader,lambda c: c.post("/explore",data={"book_name": rng.choice(words),"author_name": "","section_name": ""})),
+    ]
+    if librarian:
+        scenarios.append(("see_requests",librarian,lambda c: c.get("/librarian/requests")))
+
+    # Only seeded users have a known password.
+    seeded = (User.query.filter(User.is_librarian == 0).filter(User.email.like(f"user%{seed.EMAIL_DOMAIN}"))
+              .order_by(User.id).first())
+    if seeded is None:
+        raise RuntimeError("No seeded user to benchmark login with, run the seed command first")
+
+    def login(c):
+        response = c.post("/login",data={"email": seeded.email,"password": seed.PASSWORD})
+        # A failed login renders the form again rather than answering with an error.
+        if response.status_code != 302:
+            raise RuntimeError(f"login as {seeded.email} with the seed password failed")
+        return response
+    scenarios.append(("login",None,login))
+    return scenarios
+
+def run(iterations = 50,seed_value = 0):
+    """Run every scenario and return {route: {"p50","p95","p99","mean","queries"}} in milliseconds."""
+    rng = random.Random(seed_value)
+    app.config["WTF_CSRF_ENABLED"] = False
+    app.config["QUERY_BUDGET"] = None
+    app.config["RATE_LIMITS"] = {}
+
+    counter = _QueryCounter()
+    listen_everywhere(db.engine,"before_cursor_execute",counter)
+    results = {}
+    try:
+        for name,user,send in _scenarios(rng):
+            timings,queries = [],[]
+            for i in range(iterations):
+                client = _client_for(user) if user else app.test_client()
+
+                counter.count = 0
+                start = time.perf_counter()
+                response = send(client)
+                timings.append((time.perf_counter() - start) * 1000)
+                queries.append(counter.count)
+                if response.status_code >= 400:
+                    raise RuntimeError(f"{name} answered {response.status_code}")
+
+            results[name] = {
+                "p50": percentile(timings,50),
+                "p95": percentile(timings,95),
+                "p99": percentile(timings,99),
+                "mean": sum(timings) / len(timings),
+                "queries": max(queries),
+            }
+    finally:
+        remove_everywhere(db.engine,"before_cursor_execute",counter)
+    return results
+
+def compare(results,baseline,tolerance):
+    """
+        Return a list of regressions: routes whose p95 grew by more than tolerance
+        (a fraction) or that issue more queries than in the baseline.
+    """
+    regressions = []
+    for name,current in results.items():
+        before = baseline.get(name)
+        if not before:
+            continue
+        if current["p95"] > before["p95"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {current['p95']:.2f} ms, baseline {before['p95']:.2f} ms")
+        if current["queries"] > before["queries"]:
+            regressions.append(f"{name}: {current['queries']} queries, baseline {before['queries']}")
+    return regressions
+
+def load_baseline(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def save_baseline(path,results):
+    with open(path,"w") as f:
+        json.dump(results,f,indent=4,sort_keys=True)
+
+## Password hashing benchmark. A login costs one bcrypt check, so checks per second at a
+## cost is the login throughput that cost allows, before any database work.
+
+def password_costs(costs,seconds = 2.0,workers = 0):
+    """
+        Return {cost: {"per_core","total"}} in checks per second. per_core is measured on
+        this thread alone, total with workers processes checking at once (0 to skip).
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    import bcrypt as hasher
+
+    password = seed.PASSWORD.encode()
+    pool = ProcessPoolExecutor(max_workers = workers,mp_context = passwords.process_context()) if workers else None
+    results = {}
+    try:
+        for cost in costs:
+            hashed = hasher.hashpw(password,hasher.gensalt(cost))
+
+            checks,start = 0,time.perf_counter()
+            while time.perf_counter() - start < seconds:
+                hasher.checkpw(password,hashed)
+                checks += 1
+            per_core = checks / (time.perf_counter() - start)
+
+            total = None
+            if pool:
+                # Enough checks to keep every worker busy for about the same time.
+                count = max(workers,int(per_core * seconds * workers))
+                start = time.perf_counter()
+                list(pool.map(hasher.checkpw,[password] * count,[hashed] * count))
+                total = count / (time.perf_counter() - start)
+
+            results[cost] = {"per_core": per_core,"total": total}
+    finally:
+        if pool:
+            pool.shutdown()
+    return results
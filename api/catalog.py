@@ -0,0 +1,170 @@
+# Imports
+import csv
+import json
+from api import db
+from api.models import Book,Author,Section,Content,written,category,slugify
+from api import search
+from sqlalchemy import insert,func
+from sqlalchemy.dialects.sqlite import insert as upsert
+
+## Bulk catalog import. Streams a CSV or JSONL feed of books and upserts it in batches,
+## one transaction per batch. Author and section names are resolved through maps held
+## in memory, so a batch costs a handful of statements however many rows it has.
+##
+## Every record describes one book:
+##     name         book name, books are matched on its slug
+##     description  optional, an existing description is kept when left out
+##     authors      author names, a list in JSONL or separated by ";" in CSV
+##     sections     section names, likewise
+##     content      optional URL of the book's file
+## Authors and sections are created when first seen, matched on slugs too. Links are
+## only ever added.
+
+# Records per transaction.
+BATCH_SIZE = 5000
+
+# Separator of several names in one CSV field.
+SEPARATOR = ";"
+
+class ImportStats:
+    """Running totals of an import."""
+    def __init__(self):
+        self.rows = 0
+        self.skipped = 0
+        self.books_added = 0
+        self.books_updated = 0
+        self.authors_added = 0
+        self.sections_added = 0
+
+    def __str__(self):
+        return (f"{self.rows} rows, {self.books_added} books added, {self.books_updated} updated, "
+                f"{self.authors_added} authors and {self.sections_added} sections added, {self.skipped} skipped")
+
+def _names(value):
+    if value is None:
+        return []
+    if isinstance(value,str):
+        value = value.split(SEPARATOR)
+    return [name.strip() for name in value if name and name.strip()]
+
+def _record(raw):
+    """Normalise one feed record, None when it has no book name."""
+    name = (raw.get("name") or "").strip()
+    if not name:
+        return None
+    return {
+        "name": name,
+        "slug": slugify(name),
+        "description": raw.get("description") or None,
+        "authors": _names(raw.get("authors")),
+        "sections": _names(raw.get("sections")),
+        "content": raw.get("content") or None,
+    }
+
+def read_feed(f,format):
+    """Yield the raw records of an open csv or jsonl feed one at a time."""
+    if format == "csv":
+        yield from csv.DictReader(f)
+    elif format == "jsonl":
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+    else:
+        raise ValueError(f"Unknown catalog format {format}")
+
+def _id_map(model):
+    return dict(db.session.query(model.slug,model.id))
+
+def _create(model,names,ids):
+    """Insert the names whose slugs are missing from ids, recording their new ids. Returns how many were added."""
+    missing = {}
+    for name in names:
+        if slugify(name) not in ids:
+            missing.setdefault(slugify(name),name)
+    if missing:
+        rows = db.session.execute(insert(model).returning(model.id,model.name,model.slug),
+                                  [{"name": name} for name in sorted(missing.values())])
+        added = [(id,name,slug) for id,name,slug in rows]
+        ids.update((slug,id) for id,_,slug in added)
+        search.index_many(model,((id,name,None) for id,name,_ in added))
+    return len(missing)
+
+def _write_batch(batch,books,authors,sections,stats):
+    # Later records for the same book add to earlier ones.
+    merged = {}
+    for record in batch:
+        seen = merged.get(record["slug"])
+        if seen is None:
+            merged[record["slug"]] = record
+            continue
+        seen["description"] = record["description"] or seen["description"]
+        seen["content"] = record["content"] or seen["content"]
+        seen["authors"] += record["authors"]
+        seen["sections"] += record["sections"]
+    records = list(merged.values())
+
+    stats.authors_added += _create(Author,(n for r in records for n in r["authors"]),authors)
+    stats.sections_added += _create(Section,(n for r in records for n in r["sections"]),sections)
+
+    new = sum(r["slug"] not in books for r in records)
+    stats.books_added += new
+    stats.books_updated += len(records) - new
+
+    stmt = upsert(Book)
+    stmt = stmt.on_conflict_do_update(
+        index_elements = [Book.slug],
+        set_ = {"description": func.coalesce(stmt.excluded.description,Book.description)},
+    ).returning(Book.id,Book.name,Book.description,Book.slug)
+    rows = db.session.execute(stmt,[{"name": r["name"], "slug": r["slug"], "description": r["description"]} for r in records]).all()
+    books.update((slug,id) for id,_,_,slug in rows)
+    search.index_many(Book,(row[:3] for row in rows))
+
+    files = [{"book_id": books[r["slug"]], "filename": r["content"]} for r in records if r["content"]]
+    if files:
+        stmt = upsert(Content)
+        db.session.execute(stmt.on_conflict_do_update(index_elements = [Content.book_id],
+                                                      set_ = {"filename": stmt.excluded.filename}),files)
+
+    links = {(books[r["slug"]],authors[slugify(n)]) for r in records for n in r["authors"]}
+    if links:
+        db.session.execute(insert(written).prefix_with("OR IGNORE"),[{"book_id": b, "author_id": a} for b,a in links])
+    links = {(books[r["slug"]],sections[slugify(n)]) for r in records for n in r["sections"]}
+    if links:
+        db.session.execute(insert(category).prefix_with("OR IGNORE"),[{"book_id": b, "section_id": s} for b,s in links])
+
+    db.session.commit()
+
+def _flush(batch,books,authors,sections,stats,progress):
+    # Earlier batches stay committed when one fails, so an import can be rerun from the top.
+    try:
+        _write_batch(batch,books,authors,sections,stats)
+    except Exception:
+        db.session.rollback()
+        raise
+    if progress:
+        progress(stats)
+
+def import_catalog(records,batch_size = BATCH_SIZE,progress = None):
+    """
+        Upsert an iterable of raw feed records, committing every batch_size records.
+        progress is called with the running ImportStats after every batch. Returns
+        the final ImportStats.
+    """
+    stats = ImportStats()
+    books,authors,sections = _id_map(Book),_id_map(Author),_id_map(Section)
+
+    batch = []
+    for raw in records:
+        stats.rows += 1
+        record = _record(raw)
+        if record is None:
+            stats.skipped += 1
+            continue
+        batch.append(record)
+        if len(batch) == batch_size:
+            _flush(batch,books,authors,sections,stats,progress)
+            batch = []
+
+    if batch:
+        _flush(batch,books,authors,sections,stats,progress)
+    return stats
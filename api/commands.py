@@ -0,0 +1,191 @@
+# Imports
+import os
+import time
+import click
+from api import app,db
+from api.models import *
+from api import search
+from api import tasks
+from api import seed as generator
+from api import bench as benchmark
+from api import migrations
+from api import catalog
+from api import exports
+from api import storage
+from api import assets
+
+## Maintenance commands. Run with: flask --app api.run <command>
+
+# Command to bring an older database up to the current schema.
+@app.cli.command("migrate")
+def migrate():
+    """Apply every pending schema migration."""
+    current = migrations.get_version()
+    migrations.upgrade(progress = lambda version,description: click.echo(f"Applied {version}: {description}"))
+    click.echo(f"Database at version {migrations.get_version()} (was {current})")
+
+# Command to list schema migrations and whether they are applied.
+@app.cli.command("migrations")
+def list_migrations():
+    """Show every schema migration and whether the database has it."""
+    current = migrations.get_version()
+    for version,description,_ in migrations.MIGRATIONS:
+        click.echo(f"[{'x' if version <= current else ' '}] {version}: {description}")
+
+# Command to check that the hot queries are served by indexes.
+@app.cli.command("index-advisor")
+def index_advisor():
+    """Print the query plan of every hot query and flag full table scans."""
+    flagged = 0
+    for route,sql,plan,scans in migrations.advise():
+        status = f"SCANS {', '.join(scans)}" if scans else "ok"
+        click.echo(f"{route}: {status}")
+        click.echo("    " + " ".join(sql.split()))
+        for line in plan:
+            click.echo(f"    -> {line}")
+        flagged += bool(scans)
+    click.echo(f"{flagged} hot queries scan a whole table")
+
+# Command to rebuild the full text search index from scratch.
+@app.cli.command("rebuild-search-index")
+def rebuild_search_index():
+    """Repopulate the search index from the book, author, section and user tables."""
+    search.ensure_index()
+    search.rebuild()
+    db.session.commit()
+    click.echo("Search index rebuilt")
+
+# Command to backfill and reconcile the rating aggregates stored on Book.
+@app.cli.command("reconcile-ratings")
+def reconcile_ratings():
+    """Recompute Book.rating_count and Book.rating_total from the rating table."""
+
+    drifted = tasks.reconcile_rating_aggregates()
+    click.echo(f"Reconciled ratings for {drifted} book(s)")
+
+# Command to expire overdue borrows, for running from cron instead of the scheduler.
+@app.cli.command("expire-borrows")
+def expire_borrows():
+    """Move every overdue borrow to the read table."""
+    expired = tasks.expire_overdue_borrows()
+    click.echo(f"Expired {expired} borrow(s)")
+
+# Command to load a catalog feed of books, authors and sections.
+@app.cli.command("import-catalog")
+@click.argument("path",type=click.Path(exists=True,dir_okay=False))
+@click.option("--format","format",type=click.Choice(["csv","jsonl"]),help="Feed format, guessed from the extension by default.")
+@click.option("--batch-size",default=catalog.BATCH_SIZE,help="Records per transaction.")
+def import_catalog(path,format,batch_size):
+    """Upsert the books in a CSV or JSONL feed, see api/catalog.py for the fields."""
+    format = format or ("csv" if path.lower().endswith(".csv") else "jsonl")
+    start = time.perf_counter()
+    with open(path,newline="",encoding="utf-8") as f:
+        stats = catalog.import_catalog(catalog.read_feed(f,format),batch_size,
+                                       progress = lambda stats: click.echo(f"[{time.perf_counter() - start:8.1f}s] {stats}"))
+    click.echo(f"Imported {stats}")
+
+# Command to dump a circulation table for reporting.
+@app.cli.command("export")
+@click.argument("kind",type=click.Choice(sorted(exports.EXPORTS)))
+@click.option("--format","format",type=click.Choice(sorted(exports.FORMATS)),default="csv",help="Output format.")
+@click.option("--output",type=click.File("w",encoding="utf-8",lazy=True),default="-",help="File to write, standard output by default.")
+def export(kind,format,output):
+    """Stream a circulation table with user and book names as CSV or JSONL."""
+    for chunk in exports.export(kind,format):
+        output.write(chunk)
+
+# Command to move the file of a book into the local content store.
+@app.cli.command("store-content")
+@click.argument("book_id",type=int)
+@click.argument("path",type=click.Path(exists=True,dir_okay=False))
+def store_content(book_id,path):
+    """Copy a file into the local content store and make it the content of a book."""
+    book = Book.query.filter(Book.id == book_id).scalar()
+    if not book:
+        raise click.ClickException(f"No book with id {book_id}")
+    location = storage.local().store_path(path)
+    content = Content.query.filter(Content.book_id == book_id).scalar()
+    if content:
+        content.filename = location
+    else:
+        db.session.add(Content(book_id = book_id,filename = location))
+    db.session.commit()
+    click.echo(f"{book.name} is now served from {location}")
+
+# Command to fill the database with synthetic data for load testing.
+@app.cli.command("seed")
+@click.option("--users",default=1000,help="Users to create.")
+@click.option("--books",default=1000,help="Books to create.")
+@click.option("--authors",default=200,help="Authors to create.")
+@click.option("--sections",default=20,help="Sections to create.")
+@click.option("--ratings",default=20000,help="Ratings to attempt, duplicates are skipped.")
+@click.option("--comments",default=5000,help="Comments to create.")
+@click.option("--borrows",default=2000,help="Borrows and reads to attempt, duplicates are skipped.")
+@click.option("--requests",default=500,help="Pending requests to create.")
+@click.option("--seed",default=0,help="Random seed, for reproducible data.")
+def seed_data(users,books,authors,sections,ratings,comments,borrows,requests,seed):
+    """Append skewed synthetic users, books, ratings, comments and loans."""
+    migrations.upgrade()
+    start = time.perf_counter()
+    generator.seed(users,books,authors,sections,ratings,comments,borrows,requests,seed,
+                   progress = lambda table: click.echo(f"[{time.perf_counter() - start:8.1f}s] {table}"))
+    click.echo(f"Seeded, every generated user has the password '{generator.PASSWORD}'")
+
+# Command to benchmark the key routes and compare them to a stored baseline.
+@app.cli.command("bench")
+@click.option("--iterations",default=50,help="Requests per route.")
+@click.option("--baseline",default=os.path.join(app.instance_path,"bench_baseline.json"),help="Baseline file.")
+@click.option("--save",is_flag=True,help="Store the results as the new baseline.")
+@click.option("--tolerance",default=0.25,help="Allowed p95 growth over the baseline, as a fraction.")
+def bench(iterations,baseline,save,tolerance):
+    """Report latency percentiles and query counts for the key routes."""
+    results = benchmark.run(iterations)
+
+    click.echo(f"{'route':<16}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'queries':>10}")
+    for name,r in results.items():
+        click.echo(f"{name:<16}{r['p50']:>10.2f}{r['p95']:>10.2f}{r['p99']:>10.2f}{r['queries']:>10}")
+
+    if save:
+        benchmark.save_baseline(baseline,results)
+        click.echo(f"Baseline saved to {baseline}")
+        return
+
+    stored = benchmark.load_baseline(baseline)
+    if stored is None:
+        click.echo("No baseline to compare against, run with --save to store one")
+        return
+
+    regressions = benchmark.compare(results,stored,tolerance)
+    for regression in regressions:
+        click.echo(f"REGRESSION {regression}",err=True)
+    if regressions:
+        raise SystemExit(1)
+    click.echo("No regressions against the baseline")
+
+# Command to build the hashed and precompressed copies of the static files.
+@app.cli.command("build-assets")
+@click.option("--verbose",is_flag=True,help="List every file built.")
+def build_assets(verbose):
+    """Content hash api/static into api/static/dist with gzip and brotli variants."""
+    built = assets.build(app.static_folder,progress = (lambda logical,target: click.echo(f"{logical} -> {target}")) if verbose else None)
+    if assets.brotli is None:
+        click.echo("brotli is not installed, only gzip variants were built")
+    click.echo(f"Built {len(built)} assets into {os.path.join(app.static_folder,assets.BUILD_DIR)}")
+
+# Command to measure logins per second at several bcrypt costs.
+@app.cli.command("bench-passwords")
+@click.option("--costs",default="10,11,12,13",help="Comma separated bcrypt costs to try.")
+@click.option("--seconds",default=2.0,help="Seconds spent on each cost.")
+@click.option("--workers",default=0,help="Also measure a pool of this many processes.")
+def bench_passwords(costs,seconds,workers):
+    """Report bcrypt checks, and so logins, per second per core at each cost."""
+    costs = [int(cost) for cost in costs.split(",")]
+    results = benchmark.password_costs(costs,seconds,workers)
+
+    configured = app.config["BCRYPT_LOG_ROUNDS"]
+    click.echo(f"{'cost':<8}{'per core/s':>12}{'ms each':>10}" + (f"{f'{workers} workers/s':>16}" if workers else ""))
+    for cost,r in results.items():
+        line = f"{cost:<8}{r['per_core']:>12.1f}{1000 / r['per_core']:>10.1f}"
+        if workers:
+            line += f"{r['total']:>16.1f}"
+        click.echo(line + ("  (configured)" if cost == configured else ""))
@@ -8,9 +8,159 @@ class Config:
     SQLALCHEMY_DATABASE_URI = None
     SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+    # Trending page: entries per leaderboard, rating window in days (None for all time),
+    # the other windows ?days= may ask for and seconds a computed leaderboard is served
+    # from cache.
+    TRENDING_SIZE = 5
+    TRENDING_WINDOW_DAYS = None
+    TRENDING_WINDOWS = (7,30,90,365)
+    TRENDING_TTL = 300
+
+    # Maximum statements a request may issue before failing, None to disable.
+    # QUERY_BUDGETS overrides it per endpoint.
+    QUERY_BUDGET = None
+    QUERY_BUDGETS = {}
+
+    # Days a borrowed book may be kept, and seconds between background runs of the
+    # overdue borrow expiry (None to only run it through the expire-borrows command).
+    LOAN_DAYS = 7
+    EXPIRY_INTERVAL = None
+
+    # Books a user may have borrowed, requested or awaiting return at once.
+    LOAN_LIMIT = 5
+
+    # Rows per page on librarian listings, and the most a ?size= argument may ask for.
+    PAGE_SIZE = 25
+    MAX_PAGE_SIZE = 100
+
+    # Users kept in the login cache and seconds each stays there, see api/user_cache.py
+    USER_CACHE_SIZE = 1024
+    USER_CACHE_TTL = 60
+
+    # Catalog pages kept in the page cache (0 to disable), seconds each stays there, and a
+    # directory to keep them on disk instead of in memory. See api/page_cache.py
+    PAGE_CACHE_SIZE = 2048
+    PAGE_CACHE_TTL = 600
+    PAGE_CACHE_DIR = None
+
+    # Books shown under "Readers also read", users with more books than
+    # RECOMMENDATION_MAX_HISTORY left out of the counts, and seconds between background
+    # rebuilds of the counts, first built when the worker starts (None to show no
+    # recommendations). See api/recommendations.py
+    RECOMMENDATION_SIZE = 5
+    RECOMMENDATION_MAX_HISTORY = 500
+    RECOMMENDATION_INTERVAL = None
+
+    # bcrypt cost of new password hashes, older hashes are brought to it at login. Hashing
+    # runs in a pool of PASSWORD_HASH_WORKERS processes (0 to hash on the request thread)
+    # with at most PASSWORD_HASH_QUEUE more waiting, each for PASSWORD_HASH_TIMEOUT
+    # seconds before the login is turned away. See api/passwords.py
+    BCRYPT_LOG_ROUNDS = 12
+    PASSWORD_HASH_WORKERS = 0
+    PASSWORD_HASH_QUEUE = 32
+    PASSWORD_HASH_TIMEOUT = 10
+
+    # Requests a client may make to an endpoint, as endpoint: (requests,per seconds),
+    # and requests of an endpoint each worker serves at once. A SQLite file shares the
+    # rate limits between workers, None keeps them per worker. See api/limits.py
+    RATE_LIMITS = {
+        "login": (10,60),
+        "register": (5,300),
+        "search": (30,60),
+        "find_something": (60,60),
+    }
+    CONCURRENCY_LIMITS = {
+        "login": 4,
+        "register": 2,
+        "search": 8,
+        "find_something": 8,
+    }
+    RATE_LIMIT_STORAGE = None
+
+    # Snapshot of the database that read only routes read from (None to read everything
+    # from the primary), seconds between snapshots, and the age past which a snapshot is
+    # no longer used. A snapshot copies the whole database, so both have to be well above
+    # the time that takes. See api/replica.py
+    READ_REPLICA_PATH = None
+    READ_REPLICA_REFRESH = 60
+    READ_REPLICA_MAX_AGE = 180
+
+    # Record per request query counts and timings, see api/instrumentation.py
+    INSTRUMENTATION = os.getenv("INSTRUMENTATION") == "1"
+
+    # PRAGMA name to value, applied to every new SQLite connection.
+    SQLITE_PRAGMAS = {}
+
+    # Directory of the local content store, see api/storage.py, and the file new books
+    # point at until one is uploaded.
+    CONTENT_ROOT = os.path.join(base_dir,"../instance/content")
+    PLACEHOLDER_CONTENT = "https://drive.google.com/file/d/1a7k6giBy_fBfbH2GwxytDLjnLcVfN5GF/view?usp=sharing"
+
 # Development class
 class LocalConfig(Config):
     SQLITE_DB_DIR = os.path.join(base_dir, "../instance")
     SQLALCHEMY_DATABASE_URI = "sqlite:///" + os.path.join(SQLITE_DB_DIR,"test.db")
     DEBUG = True
-    SECRET_KEY = os.getenv("FLASK_SECRET_KEY")
\ No newline at end of file
+    SECRET_KEY = os.getenv("FLASK_SECRET_KEY")
+    EXPIRY_INTERVAL = 3600
+    RECOMMENDATION_INTERVAL = 86400
+
+# Testing class
+class TestingConfig(LocalConfig):
+    SQLALCHEMY_DATABASE_URI = os.getenv("TEST_DATABASE_URI",LocalConfig.SQLALCHEMY_DATABASE_URI)
+    TESTING = True
+    WTF_CSRF_ENABLED = False
+    SECRET_KEY = os.getenv("FLASK_SECRET_KEY","testing")
+    QUERY_BUDGET = 12
+    # Deleting a row clears every table pointing at it, one statement each.
+    QUERY_BUDGETS = {
+        "delete_specific_book": 24,
+        "delete_specific_user": 18,
+    }
+    EXPIRY_INTERVAL = None
+
+# Production class
+class ProductionConfig(Config):
+    SQLITE_DB_DIR = os.getenv("SQLITE_DB_DIR",os.path.join(base_dir, "../instance"))
+    SQLALCHEMY_DATABASE_URI = os.getenv("DATABASE_URI","sqlite:///" + os.path.join(SQLITE_DB_DIR,"test.db"))
+    DEBUG = False
+    SECRET_KEY = os.getenv("FLASK_SECRET_KEY")
+    EXPIRY_INTERVAL = 3600
+    RECOMMENDATION_INTERVAL = 86400
+
+    # WAL lets readers carry on while a write is in progress, NORMAL sync is safe under
+    # WAL, and busy_timeout makes a writer wait for the lock instead of failing with
+    # "database is locked". mmap_size and cache_size (negative means KiB) keep hot pages
+    # in memory.
+    SQLITE_PRAGMAS = {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT",5000)),
+        "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE",256 * 1024 * 1024)),
+        "cache_size": int(os.getenv("SQLITE_CACHE_SIZE",-64 * 1024)),
+        "temp_store": "MEMORY",
+    }
+
+    # Connections kept per worker process, and how many more may be opened under load.
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        "pool_size": int(os.getenv("DB_POOL_SIZE",5)),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW",10)),
+        "pool_timeout": int(os.getenv("DB_POOL_TIMEOUT",30)),
+    }
+
+    # Content store location, and whether the front end server (nginx, Apache) sends
+    # stored files itself through X-Sendfile.
+    CONTENT_ROOT = os.getenv("CONTENT_ROOT",Config.CONTENT_ROOT)
+    USE_X_SENDFILE = os.getenv("USE_X_SENDFILE") == "1"
+
+    # Read replica snapshot, see api/replica.py
+    READ_REPLICA_PATH = os.getenv("READ_REPLICA_PATH")
+    READ_REPLICA_REFRESH = int(os.getenv("READ_REPLICA_REFRESH",Config.READ_REPLICA_REFRESH))
+    READ_REPLICA_MAX_AGE = int(os.getenv("READ_REPLICA_MAX_AGE",Config.READ_REPLICA_MAX_AGE))
+
+    # Rate limit buckets shared by all workers, see api/limits.py
+    RATE_LIMIT_STORAGE = os.getenv("RATE_LIMIT_STORAGE")
+
+    # Password hashing cost and the processes hashing them, see api/passwords.py
+    BCRYPT_LOG_ROUNDS = int(os.getenv("BCRYPT_LOG_ROUNDS",Config.BCRYPT_LOG_ROUNDS))
+    PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS",Config.PASSWORD_HASH_WORKERS))
@@ -1,4 +1,59 @@
+import weakref
+from flask import g,has_app_context
 from flask_sqlalchemy import SQLAlchemy
-db = SQLAlchemy() 
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
 
-# Database setup in its own file.
\ No newline at end of file
+class RoutingSession(Session):
+    """
+        Session sending the reads of routes marked read only to the read replica, see
+        api/replica.py. Flushes and data changing statements always go to the primary.
+    """
+    def get_bind(self,mapper = None,clause = None,bind = None,**kwargs):
+        if bind is None and has_app_context():
+            replica = g.get("read_engine")
+            if replica is not None and not self._flushing and not getattr(clause,"is_dml",False):
+                return replica
+        return super().get_bind(mapper = mapper,clause = clause,bind = bind,**kwargs)
+
+db = SQLAlchemy(session_options = {"class_": RoutingSession})
+
+# Database setup in its own file.
+
+def apply_pragmas(engine,pragmas):
+    """Run the given PRAGMA statements on every new connection of an SQLite engine."""
+    if not pragmas or engine.dialect.name != "sqlite":
+        return
+
+    @event.listens_for(engine,"connect")
+    def set_pragmas(dbapi_connection,connection_record):
+        cursor = dbapi_connection.cursor()
+        for name,value in pragmas.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+        cursor.close()
+
+## Statement listeners that have to see every query, wherever it runs: the primary
+## engine and the read replica engines, see api/replica.py, opened at any time.
+
+_replicas = weakref.WeakSet()
+_listeners = []
+
+def listen_everywhere(engine,identifier,fn):
+    """Listen to an event of engine and of every read replica engine, open or opened later."""
+    event.listen(engine,identifier,fn)
+    _listeners.append((identifier,fn))
+    for replica in list(_replicas):
+        event.listen(replica,identifier,fn)
+
+def remove_everywhere(engine,identifier,fn):
+    """Undo listen_everywhere."""
+    event.remove(engine,identifier,fn)
+    _listeners.remove((identifier,fn))
+    for replica in list(_replicas):
+        event.remove(replica,identifier,fn)
+
+def add_replica(engine):
+    """Give a newly opened read replica engine the listeners added through listen_everywhere."""
+    for identifier,fn in _listeners:
+        event.listen(engine,identifier,fn)
+    _replicas.add(engine)
@@ -0,0 +1,75 @@
+# Imports
+import csv
+import io
+import json
+from api import db
+from api.models import User,Book,Borrow,Return,Read,Rating,Requested
+
+## Circulation exports. Each table is streamed out with the names of its users and books
+## joined in, rows being fetched YIELD_PER at a time from a server side cursor and
+## written out one by one, so memory stays flat however large the table.
+
+# Rows fetched from the cursor at a time.
+YIELD_PER = 1000
+
+FORMATS = {
+    "csv": "text/csv",
+    "jsonl": "application/x-ndjson",
+}
+
+# Columns of each export besides the user and book names, in order.
+EXPORTS = {
+    "borrow": (Borrow,[Borrow.book_id,Borrow.user_id,Borrow.b_date]),
+    "return": (Return,[Return.id,Return.book_id,Return.user_id,Return.b_date,Return.r_date]),
+    "read": (Read,[Read.book_id,Read.user_id]),
+    "rating": (Rating,[Rating.book_id,Rating.user_id,Rating.score,Rating.r_date]),
+    "requested": (Requested,[Requested.id,Requested.book_id,Requested.user_id,Requested.r_date]),
+}
+
+def _statement(kind):
+    model,columns = EXPORTS[kind]
+    # Outer joins so rows pointing at deleted users or books still come out.
+    return (db.select(*columns,User.username,Book.name.label("book_name"))
+            .outerjoin(User,User.id == model.user_id)
+            .outerjoin(Book,Book.id == model.book_id)
+            .order_by(*model.__table__.primary_key.columns)
+            .execution_options(yield_per = YIELD_PER))
+
+def rows(kind):
+    """Yield every row of an export as a dict, streamed from the database."""
+    result = db.session.execute(_statement(kind))
+    try:
+        for row in result.mappings():
+            yield dict(row)
+    finally:
+        result.close()
+
+def _value(value):
+    return value.isoformat(sep=" ") if hasattr(value,"isoformat") else value
+
+def as_csv(kind):
+    """Yield an export as CSV text, a header line and then one line per row."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([c.key for c in _statement(kind).selected_columns])
+    for row in rows(kind):
+        writer.writerow([_value(v) for v in row.values()])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+def as_jsonl(kind):
+    """Yield an export as JSON lines, one object per row."""
+    for row in rows(kind):
+        yield json.dumps({k: _value(v) for k,v in row.items()}) + "\n"
+
+def export(kind,format):
+    """Yield the text of an export in the given format."""
+    if kind not in EXPORTS:
+        raise ValueError(f"Unknown export {kind}")
+    if format == "csv":
+        return as_csv(kind)
+    if format == "jsonl":
+        return as_jsonl(kind)
+    raise ValueError(f"Unknown export format {format}")
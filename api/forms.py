@@ -1,5 +1,6 @@
 # Imports
 from flask_wtf import FlaskForm
+from flask_wtf.file import FileField
 from wtforms import StringField,PasswordField,SubmitField,BooleanField,RadioField
 from wtforms.validators import DataRequired,Length,Email,EqualTo
 
@@ -47,6 +48,7 @@ class EditBookForm(FlaskForm):
     name = StringField('Book Name',validators=[DataRequired()])
     description = StringField('Description',validators=[DataRequired()])
     file_path = StringField('Content Address',validators=[DataRequired()]) 
+    upload = FileField('Upload File')
     submit = SubmitField('Edit')
     
 class EditAuthorForm(FlaskForm):
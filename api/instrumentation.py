@@ -0,0 +1,122 @@
+# Imports
+import threading
+import time
+from flask import request,before_render_template,template_rendered
+from api.database import listen_everywhere
+
+## Request instrumentation. When INSTRUMENTATION is on, every request records its
+## statement count, time spent in the database, slowest statement and template render
+## time. The numbers go out in a Server-Timing header and into per endpoint totals
+## shown on the librarian stats page.
+
+# Measurements for the request being handled by this thread.
+_current = threading.local()
+
+# Totals per endpoint, guarded by _lock.
+_totals = {}
+_lock = threading.Lock()
+
+class EndpointStats:
+    """Running totals for one endpoint."""
+    def __init__(self,endpoint):
+        self.endpoint = endpoint
+        self.requests = 0
+        self.queries = 0
+        self.total_time = 0.0
+        self.db_time = 0.0
+        self.render_time = 0.0
+        self.max_time = 0.0
+        self.slowest_time = 0.0
+        self.slowest_statement = None
+
+    def add(self,measurement,elapsed):
+        self.requests += 1
+        self.queries += measurement.queries
+        self.total_time += elapsed
+        self.db_time += measurement.db_time
+        self.render_time += measurement.render_time
+        self.max_time = max(self.max_time,elapsed)
+        if measurement.slowest_time > self.slowest_time:
+            self.slowest_time = measurement.slowest_time
+            self.slowest_statement = measurement.slowest_statement
+
+    def mean(self,total):
+        return total / self.requests if self.requests else 0
+
+class Measurement:
+    """What one request has done so far."""
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.render_time = 0.0
+        self.slowest_time = 0.0
+        self.slowest_statement = None
+
+def _measurement():
+    return getattr(_current,"measurement",None)
+
+def _before_execute(conn,cursor,statement,parameters,context,executemany):
+    conn.info.setdefault("query_start",[]).append(time.perf_counter())
+
+def _after_execute(conn,cursor,statement,parameters,context,executemany):
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    measurement = _measurement()
+    if measurement is None:
+        return
+    measurement.queries += 1
+    measurement.db_time += elapsed
+    if elapsed > measurement.slowest_time:
+        measurement.slowest_time = elapsed
+        measurement.slowest_statement = statement
+
+def _before_render(sender,template,context,**extra):
+    _current.render_start = time.perf_counter()
+
+def _after_render(sender,template,context,**extra):
+    measurement = _measurement()
+    if measurement is not None:
+        measurement.render_time += time.perf_counter() - _current.render_start
+
+def _start_request():
+    _current.measurement = Measurement()
+
+def _finish_request(response):
+    measurement = _measurement()
+    _current.measurement = None
+    if measurement is None:
+        return response
+
+    elapsed = time.perf_counter() - measurement.start
+    response.headers["Server-Timing"] = ", ".join([
+        f'db;dur={measurement.db_time * 1000:.2f};desc="{measurement.queries} queries"',
+        f"render;dur={measurement.render_time * 1000:.2f}",
+        f"total;dur={elapsed * 1000:.2f}",
+    ])
+
+    endpoint = request.endpoint or "unmatched"
+    with _lock:
+        if endpoint not in _totals:
+            _totals[endpoint] = EndpointStats(endpoint)
+        _totals[endpoint].add(measurement,elapsed)
+    return response
+
+def snapshot():
+    """Return the totals of every endpoint seen, slowest on average first."""
+    with _lock:
+        stats = list(_totals.values())
+    return sorted(stats,key=lambda s: s.mean(s.total_time),reverse=True)
+
+def reset():
+    """Forget all collected totals."""
+    with _lock:
+        _totals.clear()
+
+def instrument(app,engine):
+    """Install the engine listeners, template signals and request hooks."""
+    listen_everywhere(engine,"before_cursor_execute",_before_execute)
+    listen_everywhere(engine,"after_cursor_execute",_after_execute)
+    before_render_template.connect(_before_render,app)
+    template_rendered.connect(_after_render,app)
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
@@ -0,0 +1,170 @@
+# Imports
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from flask import request,current_app,g
+from flask_login import current_user
+
+## Admission control for the expensive routes. Two checks run before the view:
+##
+## Rate limits. Every client gets a token bucket per endpoint listed in RATE_LIMITS,
+## holding up to the endpoint's request count and refilling over its period. A request
+## with no token left is answered 429 with Retry-After. Clients are logged in users by
+## id and anyone else by address. Buckets live in memory, or in a SQLite file shared
+## by every worker when RATE_LIMIT_STORAGE is set.
+##
+## Concurrency gates. Each worker serves at most CONCURRENCY_LIMITS[endpoint] requests
+## of an endpoint at once, and turns the rest away with 503 rather than letting them
+## queue up behind the busy ones and tie up every thread.
+##
+## Both only count the requests doing the expensive work: form submissions, and GETs
+## carrying a search. Showing the empty form is free.
+
+# Takes between two sweeps of full buckets out of the shared file, per connection.
+PRUNE_EVERY = 1000
+
+# Query arguments with which a GET of an endpoint runs a search, as later pages of
+# results do.
+SEARCH_ARGUMENTS = {"find_something": "obj_name"}
+
+class MemoryBuckets:
+    """Buckets of one worker. The least recently used are dropped once size are kept."""
+    def __init__(self,size = 100000):
+        self.size = size
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+
+    def take(self,key,capacity,period,now):
+        """Take a token from the bucket of key, returning 0 or the seconds until one is available."""
+        with self.lock:
+            tokens,updated = self.buckets.pop(key,(capacity,now))
+            tokens,wait = _refill(tokens,updated,capacity,period,now)
+            self.buckets[key] = (tokens,now)
+            while len(self.buckets) > self.size:
+                self.buckets.popitem(last=False)
+            return wait
+
+    def clear(self):
+        with self.lock:
+            self.buckets.clear()
+
+class SQLiteBuckets:
+    """Buckets shared by every worker through one SQLite file, apart from the main database."""
+    def __init__(self,path):
+        self.path = path
+        self.local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)),exist_ok=True)
+        with self._connection() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS bucket (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL, full REAL NOT NULL)")
+
+    def _connection(self):
+        conn = getattr(self.local,"conn",None)
+        if conn is None:
+            conn = sqlite3.connect(self.path,timeout=5,isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")
+            self.local.conn = conn
+            self.local.takes = 0
+        return conn
+
+    def take(self,key,capacity,period,now):
+        conn = self._connection()
+        # IMMEDIATE takes the write lock up front, so two workers cannot both spend the last token.
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT tokens,updated FROM bucket WHERE key = ?",(key,)).fetchone()
+            tokens,updated = row or (capacity,now)
+            tokens,wait = _refill(tokens,updated,capacity,period,now)
+            full = now + (capacity - tokens) * period / capacity
+            conn.execute("INSERT OR REPLACE INTO bucket (key,tokens,updated,full) VALUES (?,?,?,?)",(key,tokens,now,full))
+            # A bucket that has filled up again is the same as no bucket at all.
+            self.local.takes += 1
+            if self.local.takes % PRUNE_EVERY == 0:
+                conn.execute("DELETE FROM bucket WHERE full < ?",(now,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return wait
+
+    def clear(self):
+        self._connection().execute("DELETE FROM bucket")
+
+def _refill(tokens,updated,capacity,period,now):
+    """Refill a bucket for the time since updated and take a token. Returns (tokens,wait)."""
+    tokens = min(capacity,tokens + (now - updated) * capacity / period)
+    if tokens >= 1:
+        return tokens - 1,0
+    return tokens,(1 - tokens) * period / capacity
+
+_buckets = None
+_gates = {}
+_lock = threading.Lock()
+
+def buckets():
+    global _buckets
+    with _lock:
+        if _buckets is None:
+            path = current_app.config["RATE_LIMIT_STORAGE"]
+            _buckets = SQLiteBuckets(path) if path else MemoryBuckets()
+    return _buckets
+
+def _gate(endpoint,limit):
+    with _lock:
+        if endpoint not in _gates:
+            _gates[endpoint] = threading.BoundedSemaphore(limit)
+        return _gates[endpoint]
+
+def client():
+    """What a client is told apart by: their user id once logged in, else their address."""
+    if not current_user.is_anonymous:
+        return f"user:{current_user.id}"
+    return f"ip:{request.remote_addr}"
+
+def _refuse(status,retry_after,message):
+    return message,status,{"Retry-After": str(max(1,math.ceil(retry_after)))}
+
+def _expensive():
+    if request.method == "POST":
+        return True
+    argument = SEARCH_ARGUMENTS.get(request.endpoint)
+    return argument is not None and bool(request.args.get(argument))
+
+def _admit():
+    config = current_app.config
+    endpoint = request.endpoint
+    if endpoint not in config["RATE_LIMITS"] and endpoint not in config["CONCURRENCY_LIMITS"]:
+        return
+    if not _expensive():
+        return
+
+    limit = config["RATE_LIMITS"].get(endpoint)
+    if limit:
+        capacity,period = limit
+        wait = buckets().take(f"{endpoint}:{client()}",capacity,period,time.time())
+        if wait:
+            return _refuse(429,wait,"Too many requests, please slow down")
+
+    concurrency = config["CONCURRENCY_LIMITS"].get(endpoint)
+    if concurrency:
+        gate = _gate(endpoint,concurrency)
+        if not gate.acquire(blocking=False):
+            return _refuse(503,1,"Server busy, please try again in a moment")
+        g.admission_gate = gate
+
+def _release(exception):
+    gate = g.pop("admission_gate",None)
+    if gate is not None:
+        gate.release()
+
+def reset():
+    """Forget every bucket, for the command line and tests."""
+    buckets().clear()
+
+def install(app):
+    """Check every request of a limited endpoint before it reaches the view."""
+    app.before_request(_admit)
+    app.teardown_request(_release)
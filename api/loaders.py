@@ -0,0 +1,108 @@
+# Imports
+import threading
+from flask import request,current_app,has_request_context
+from sqlalchemy import event
+from sqlalchemy.orm import Session,selectinload,joinedload
+from api.database import db,listen_everywhere
+from api.models import *
+
+## Loader profiles. Each is the set of eager loading options matching what one
+## template walks, so rendering it does not lazy load row by row.
+
+# user_specific/profile.html: the logged in user's loans, each with its book.
+PROFILE = (
+    selectinload(User.borrowed).joinedload(Borrow.book),
+    selectinload(User.read).joinedload(Read.book),
+    selectinload(User.requested).joinedload(Requested.book),
+    selectinload(User.returned).joinedload(Return.book),
+)
+
+# librarian_specific/object_user.html: as above plus comments.
+OBJECT_USER = (
+    selectinload(User.borrowed).joinedload(Borrow.book),
+    selectinload(User.read).joinedload(Read.book),
+    selectinload(User.requested).joinedload(Requested.book),
+    selectinload(User.returned).joinedload(Return.book),
+    selectinload(User.comments).joinedload(Comment.book),
+)
+
+# librarian_specific/all_requests.html, for Requested and Return rows respectively.
+ALL_REQUESTS = (
+    joinedload(Requested.user),
+    joinedload(Requested.book),
+)
+ALL_RETURNS = (
+    joinedload(Return.user),
+    joinedload(Return.book),
+)
+
+# A page of comments under a book, for Comment rows.
+COMMENTS = (
+    joinedload(Comment.user),
+)
+
+# librarian_specific/object_book.html: borrowers and requesters. Comments are paged separately.
+OBJECT_BOOK = (
+    selectinload(Book.borrowed).joinedload(Borrow.user),
+    selectinload(Book.requested).joinedload(Requested.user),
+)
+
+# user_specific/author.html and librarian_specific/object_author.html.
+AUTHOR = (
+    selectinload(Author.books),
+)
+
+# user_specific/specific_section.html and librarian_specific/object_section.html.
+SECTION = (
+    selectinload(Section.books),
+)
+
+## Query budget. With QUERY_BUDGET set (the testing config does), any request issuing
+## more statements than its budget fails, which catches new N+1 patterns early. The
+## budget is also checked right before each commit, so a write over budget fails
+## without leaving anything behind.
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+# Statement count of the request being handled by this thread.
+_counter = threading.local()
+
+def _count_statement(conn,cursor,statement,parameters,context,executemany):
+    _counter.count = getattr(_counter,"count",0) + 1
+
+def _reset_counter():
+    _counter.count = 0
+    _counter.exceeded = False
+
+def _enforce():
+    budgets = current_app.config["QUERY_BUDGETS"]
+    budget = budgets.get(request.endpoint,current_app.config["QUERY_BUDGET"])
+    used = getattr(_counter,"count",0)
+    # Raised once, so the error page itself is not failed again.
+    if budget is not None and used > budget and not getattr(_counter,"exceeded",False):
+        _counter.exceeded = True
+        raise QueryBudgetExceeded(f"{request.endpoint} issued {used} queries, budget is {budget}")
+
+def _check_before_commit(session):
+    # Flushed first so the statements of the flush count too. Raising here stops the
+    # commit, and _rollback_failed throws the flushed changes away.
+    if has_request_context():
+        session.flush()
+        _enforce()
+
+def _rollback_failed(exception):
+    if isinstance(exception,QueryBudgetExceeded):
+        db.session.rollback()
+
+def _check_budget(response):
+    _enforce()
+    return response
+
+def enforce_query_budget(app,engine):
+    """Install the request hooks and engine listener checking query budgets."""
+    listen_everywhere(engine,"before_cursor_execute",_count_statement)
+    event.listen(Session,"before_commit",_check_before_commit)
+    app.before_request(_reset_counter)
+    app.after_request(_check_budget)
+    app.teardown_request(_rollback_failed)
@@ -0,0 +1,137 @@
+# Imports
+from datetime import date,datetime,time,timedelta
+from flask import current_app
+from api import db
+from api.models import Borrow,Requested,Return
+from sqlalchemy import and_,case,delete,func,insert,literal,null,union_all
+
+## Loan state of a user. Counts the books a user holds against the quota and finds what
+## they are doing with one particular book, all in a single aggregate query instead of
+## loading the borrowed, requested and returned collections.
+
+# States of a book for a user, as used by user_specific/book.html.
+BORROWED = 0
+REQUESTED = 1
+UNAVAILABLE = 2
+REQUESTABLE = 3
+
+class LoanState:
+    """What a user holds, and what they hold of one book if a book was given."""
+    def __init__(self,borrowed = 0,requested = 0,returned = 0,borrowed_on = None,
+                 has_borrowed = False,has_requested = False,has_returned = False):
+        self.borrowed = borrowed
+        self.requested = requested
+        self.returned = returned
+        self.borrowed_on = borrowed_on
+        self.has_borrowed = has_borrowed
+        self.has_requested = has_requested
+        self.has_returned = has_returned
+
+    @property
+    def total(self):
+        return self.borrowed + self.requested + self.returned
+
+    @property
+    def at_limit(self):
+        return self.total >= current_app.config["LOAN_LIMIT"]
+
+    @property
+    def state(self):
+        """The state of the book: awaiting return, requested, borrowed or quota full, else requestable."""
+        if self.has_returned:
+            return UNAVAILABLE
+        if self.has_requested:
+            return REQUESTED
+        if self.has_borrowed:
+            return BORROWED
+        if self.at_limit:
+            return UNAVAILABLE
+        return REQUESTABLE
+
+    @property
+    def return_date(self):
+        """Date the borrowed book is due back, as YYYY-MM-DD."""
+        if self.borrowed_on is None:
+            return None
+        return str(self.borrowed_on + timedelta(days=current_app.config["LOAN_DAYS"]))[:10]
+
+def _part(model,kind,user_id,book_id,date = None):
+    this_book = model.book_id == book_id
+    return db.select(
+        literal(kind).label("kind"),
+        func.count().label("n"),
+        func.coalesce(func.sum(case((this_book,1),else_=0)),0).label("this_book"),
+        func.max(case((this_book,date))).label("since") if date is not None else null().label("since"),
+    ).where(model.user_id == user_id)
+
+def loan_state(user_id,book_id = None):
+    """Return the LoanState of a user, looking at book_id in particular if given."""
+    stmt = union_all(
+        _part(Borrow,"borrowed",user_id,book_id,Borrow.b_date),
+        _part(Requested,"requested",user_id,book_id),
+        _part(Return,"returned",user_id,book_id),
+    )
+    rows = {row.kind: row for row in db.session.execute(stmt)}
+
+    return LoanState(
+        borrowed = rows["borrowed"].n,
+        requested = rows["requested"].n,
+        returned = rows["returned"].n,
+        borrowed_on = rows["borrowed"].since,
+        has_borrowed = bool(rows["borrowed"].this_book),
+        has_requested = bool(rows["requested"].this_book),
+        has_returned = bool(rows["returned"].this_book),
+    )
+
+## Settling many requests at once. Librarians clearing a backlog pick requests by id or
+## by filter, and all of them are granted or rejected with one INSERT ... SELECT and one
+## DELETE in a single transaction.
+
+# Outcome of each request in settle_requests.
+GRANTED = "granted"
+ALREADY_BORROWED = "already borrowed"
+REJECTED = "rejected"
+NOT_FOUND = "not found"
+
+def settle_requests(action,ids = None,book_id = None,older_than = None,now = None):
+    """
+        Grant or reject every pending request matching all the given selectors: a list of
+        request ids, a book and a minimum age in days. At least one selector is required.
+        Returns {request id: outcome}, ids that matched nothing being NOT_FOUND.
+    """
+    if action not in ("grant","reject"):
+        raise ValueError(f"Unknown action {action}")
+    if ids is None and book_id is None and older_than is None:
+        raise ValueError("No requests selected")
+
+    now = now or datetime.now()
+    conditions = []
+    if ids is not None:
+        conditions.append(Requested.id.in_(ids))
+    if book_id is not None:
+        conditions.append(Requested.book_id == book_id)
+    if older_than is not None:
+        conditions.append(Requested.r_date <= now - timedelta(days=older_than))
+
+    # Finding the matches up front to report on them, noting those already borrowed.
+    borrowed = db.select(Borrow.book_id).where(Borrow.book_id == Requested.book_id).where(Borrow.user_id == Requested.user_id).exists()
+    matched = db.session.execute(db.select(Requested.id,borrowed).where(*conditions)).all()
+    results = {id: NOT_FOUND for id in ids or []}
+    if not matched:
+        return results
+
+    # Requests arriving meanwhile get higher ids, so they are left alone.
+    selected = and_(*conditions,Requested.id <= max(id for id,_ in matched))
+    if action == "grant":
+        today = datetime.combine(date.today(),time())
+        source = db.select(Requested.book_id,Requested.user_id,literal(today,Borrow.b_date.type)).where(selected)
+        db.session.execute(insert(Borrow).prefix_with("OR IGNORE").from_select(["book_id","user_id","b_date"],source))
+    db.session.execute(delete(Requested).where(selected))
+    db.session.commit()
+
+    for id,was_borrowed in matched:
+        if action == "reject":
+            results[id] = REJECTED
+        else:
+            results[id] = ALREADY_BORROWED if was_borrowed else GRANTED
+    return results
@@ -0,0 +1,175 @@
+# Imports
+from datetime import datetime
+from api import db
+from api.models import *
+from api import search,tasks
+from sqlalchemy import inspect,text
+
+## Versioned schema migrations. The version of a database is kept in SQLite's
+## user_version pragma. Each migration is written to be safe on databases that already
+## have some of its changes, since older databases were patched by hand.
+
+def get_version():
+    return db.session.execute(text("PRAGMA user_version")).scalar()
+
+def _set_version(version):
+    db.session.execute(text(f"PRAGMA user_version = {int(version)}"))
+
+def _add_column(table,name,ddl):
+    columns = [c["name"] for c in inspect(db.engine).get_columns(table)]
+    if name not in columns:
+        db.session.execute(text(f'ALTER TABLE "{table}" ADD COLUMN {name} {ddl}'))
+
+def _add_index(name,table,*columns):
+    db.session.execute(text(f'CREATE INDEX IF NOT EXISTS {name} ON "{table}" ({", ".join(columns)})'))
+
+def _rating_aggregates():
+    _add_column("book","rating_count","INTEGER NOT NULL DEFAULT 0")
+    _add_column("book","rating_total","INTEGER NOT NULL DEFAULT 0")
+    tasks.reconcile_rating_aggregates()
+
+def _rating_dates():
+    _add_column("rating","r_date","DATETIME")
+
+def _search_index():
+    search.ensure_index()
+
+def _lookup_indexes():
+    # Foreign keys not covered by the leading column of a primary key.
+    _add_index("ix_requested_book_id","requested","book_id")
+    _add_index("ix_requested_user_id","requested","user_id")
+    _add_index("ix_return_book_id","return","book_id")
+    _add_index("ix_return_user_id","return","user_id")
+    _add_index("ix_comment_book_id","comment","book_id")
+    _add_index("ix_read_user_id","read","user_id")
+    _add_index("ix_borrow_user_id","borrow","user_id")
+    _add_index("ix_rating_user_id","rating","user_id")
+    _add_index("ix_written_author_id","written","author_id")
+    _add_index("ix_category_section_id","category","section_id")
+
+    # Range filters of the expiry job and windowed trending.
+    _add_index("ix_borrow_b_date","borrow","b_date")
+    _add_index("ix_rating_r_date","rating","r_date")
+
+def _comment_surrogate_key():
+    # Comments used a (user_id,book_id,id) primary key with ids allocated by the app.
+    # SQLite cannot alter a primary key, so the table is rebuilt. Should two comments
+    # share an id the later one is given a fresh id.
+    if inspect(db.engine).get_pk_constraint("comment")["constrained_columns"] != ["id"]:
+        db.session.execute(text("""
+            CREATE TABLE comment_new (
+                id INTEGER NOT NULL,
+                user_id INTEGER NOT NULL,
+                book_id INTEGER NOT NULL,
+                content TEXT NOT NULL,
+                PRIMARY KEY (id),
+                FOREIGN KEY(user_id) REFERENCES user (id),
+                FOREIGN KEY(book_id) REFERENCES book (id)
+            )
+        """))
+        db.session.execute(text("""
+            INSERT INTO comment_new (id,user_id,book_id,content)
+            SELECT CASE WHEN rowid = (SELECT min(rowid) FROM comment AS c WHERE c.id = comment.id) THEN id END,
+                   user_id,book_id,content
+            FROM comment ORDER BY rowid
+        """))
+        db.session.execute(text("DROP TABLE comment"))
+        db.session.execute(text("ALTER TABLE comment_new RENAME TO comment"))
+
+    db.session.execute(text("DROP INDEX IF EXISTS ix_comment_book_id"))
+    _add_index("ix_comment_book_id_id","comment","book_id","id")
+    _add_index("ix_comment_user_id","comment","user_id")
+
+def _slugs():
+    # Names differing only in case or spacing share a slug, later rows get their id appended.
+    # SQLite cannot add a NOT NULL column without a default, the app always sets it.
+    for model in (Book,Author,Section):
+        table = model.__tablename__
+        _add_column(table,"slug","VARCHAR(80)")
+        taken,rows = set(),[]
+        for id,name in db.session.execute(text(f'SELECT id,name FROM "{table}" ORDER BY id')):
+            slug = slugify(name)
+            if slug in taken:
+                slug = f"{slug}-{id}"
+            taken.add(slug)
+            rows.append({"id": id,"slug": slug})
+        if rows:
+            db.session.execute(text(f'UPDATE "{table}" SET slug = :slug WHERE id = :id'),rows)
+        db.session.execute(text(f'CREATE UNIQUE INDEX IF NOT EXISTS ix_{table}_slug ON "{table}" (slug)'))
+
+def _search_rowids():
+    # Entries are now found by a rowid derived from their row, older ones got any rowid.
+    if db.session.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'search_index'")).scalar():
+        search.rebuild()
+
+# Every migration in order as (version,description,function). Append only.
+MIGRATIONS = [
+    (1,"Rating aggregates on book",_rating_aggregates),
+    (2,"Rating dates",_rating_dates),
+    (3,"Full text search index",_search_index),
+    (4,"Foreign key and lookup indexes",_lookup_indexes),
+    (5,"Surrogate key for comments",_comment_surrogate_key),
+    (6,"Slugs for lookups by name",_slugs),
+    (7,"Search index entries keyed by row",_search_rowids),
+]
+
+def pending():
+    """Return the migrations not yet applied to the connected database."""
+    version = get_version()
+    return [m for m in MIGRATIONS if m[0] > version]
+
+def upgrade(progress = None):
+    """Create missing tables, then apply each pending migration in its own transaction."""
+    db.create_all()
+    for version,description,migrate in pending():
+        try:
+            migrate()
+            _set_version(version)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        if progress:
+            progress(version,description)
+
+## Index advisor. Runs EXPLAIN QUERY PLAN over the statements the routes issue most
+## and reports those that still scan a whole table.
+
+def _hot_queries():
+    """Return (route,statement) for the lookups behind the busiest routes."""
+    select = db.select
+    return [
+        ("selected_book",select(Borrow).where(Borrow.user_id == 1)),
+        ("selected_book",select(Requested).where(Requested.user_id == 1)),
+        ("selected_book",select(Return).where(Return.user_id == 1)),
+        ("selected_book",select(Comment).where(Comment.book_id == 1).where(Comment.id < 100).order_by(Comment.id.desc()).limit(25)),
+        ("selected_genre",select(Section).where(Section.slug == "fiction")),
+        ("add_author_to_book",select(Author).where(Author.slug == "jane-doe")),
+        ("add_section_to_book",select(Book).where(Book.slug == "dark-tides")),
+        ("home",select(Read).where(Read.user_id == 1)),
+        ("request_book",select(Requested).where(Requested.book_id == 1).where(Requested.user_id == 1)),
+        ("_return",select(Return).where(Return.book_id == 1).where(Return.user_id == 1)),
+        ("see_specific_author",select(written.c.book_id).where(written.c.author_id == 1)),
+        ("see_specific_section",select(category.c.book_id).where(category.c.section_id == 1)),
+        ("delete_specific_book",select(Requested).where(Requested.book_id == 1)),
+        ("delete_specific_book",select(Return).where(Return.book_id == 1)),
+        ("delete_specific_user",select(Rating).where(Rating.user_id == 1)),
+        ("delete_specific_user",select(Read).where(Read.user_id == 1)),
+        ("expire_overdue_borrows",select(Borrow).where(Borrow.b_date <= datetime(2024,1,1))),
+        ("trending",select(Rating).where(Rating.r_date >= datetime(2024,1,1))),
+    ]
+
+def advise():
+    """Return (route,sql,plan lines,full scan tables) for every hot query."""
+    # EXPLAIN does not check whether the schema changed, so reading sqlite_master first
+    # makes a connection opened before a migration see the new indexes.
+    db.session.execute(text("SELECT count(*) FROM sqlite_master")).scalar()
+
+    report = []
+    for route,stmt in _hot_queries():
+        compiled = stmt.compile(db.engine)
+        params = tuple(compiled.params[name] for name in compiled.positiontup)
+        plan = [row[-1] for row in db.session.connection().exec_driver_sql("EXPLAIN QUERY PLAN " + str(compiled),params)]
+        scans = [line.split()[1] for line in plan if line.startswith("SCAN ") and "INDEX" not in line]
+        report.append((route,str(compiled),plan,scans))
+    return report
@@ -1,7 +1,28 @@
 # Imports
+import unicodedata
 from api.database import db 
-from datetime import date
+from datetime import date,datetime
 from flask_login import UserMixin
+from sqlalchemy.orm import validates
+
+def slugify(name):
+    """Normalised form of a name that lookups by name match on: case folded, with spaces as hyphens."""
+    return "-".join(unicodedata.normalize("NFKC",name or "").casefold().split())
+
+def _default_slug(context):
+    return slugify(context.get_current_parameters().get("name"))
+
+class Slugged:
+    """
+        Keeps a unique, indexed slug of the name, so lookups by name are index seeks. Set
+        by the ORM when name is assigned and by the column default on Core inserts.
+    """
+    slug = db.Column(db.String(80), unique = True, index = True, nullable = False, default = _default_slug)
+
+    @validates("name")
+    def _update_slug(self,key,name):
+        self.slug = slugify(name)
+        return name
 
 # Table to store written relation between Book and Author
 # Finalised
@@ -9,6 +30,7 @@ written = db.Table('written',
     db.Column('book_id', db.Integer, db.ForeignKey('book.id'), primary_key=True),
     db.Column('author_id', db.Integer, db.ForeignKey('author.id'), primary_key=True)
 )
+db.Index('ix_written_author_id', written.c.author_id)
 
 # Table to store category relation between Book and Section
 # Finalised
@@ -16,6 +38,7 @@ category = db.Table('category',
     db.Column('book_id', db.Integer, db.ForeignKey('book.id'), primary_key=True),
     db.Column('section_id', db.Integer, db.ForeignKey('section.id'), primary_key=True)
 )
+db.Index('ix_category_section_id', category.c.section_id)
 
 # Finalised
 class Content(db.Model):
@@ -67,7 +90,7 @@ class User(db.Model,UserMixin):
         return f"User({self.username},{self.email})"
 
 # Finalised
-class Book(db.Model):
+class Book(Slugged,db.Model):
     """
         Representative class for a book.
     """
@@ -78,6 +101,10 @@ class Book(db.Model):
     name = db.Column(db.String(80), unique = True, nullable = False)
     description = db.Column(db.Text)
 
+    # Running rating aggregates, maintained alongside every Rating write.
+    rating_count = db.Column(db.Integer, nullable = False, default = 0, server_default = "0")
+    rating_total = db.Column(db.Integer, nullable = False, default = 0, server_default = "0")
+
     # Reference to all ratings assigned to the book
     ratings = db.relationship('Rating',backref='book',lazy=True)
 
@@ -95,24 +122,27 @@ class Book(db.Model):
     
     def get_rating(self):
         """Return average rating associated with the book."""
-        avg_score = 0
-        all_ratings = self.ratings
-        for rating in all_ratings:
-            avg_score += rating.score
-    
-        if (len(all_ratings)):
-            avg_score = avg_score / len(all_ratings)
-            avg_score = round(avg_score,1)
+        if not self.rating_count:
+            return 0
+        return round(self.rating_total / self.rating_count,1)
+
+    def record_rating(self,score,previous = None):
+        """
+            Update the running aggregates for a new score, or for a changed score if the
+            previous score is given. Done as SQL expressions so concurrent raters do not
+            overwrite each other's counts.
+        """
+        if previous is None:
+            self.rating_count = Book.rating_count + 1
+            self.rating_total = Book.rating_total + score
         else:
-            avg_score = 0
-
-        return avg_score
+            self.rating_total = Book.rating_total + (score - previous)
 
     def __lt__(self,other):
-        return len(self.ratings) < len(other.ratings)
+        return self.rating_count < other.rating_count
     
 #Finalised
-class Author(db.Model):
+class Author(Slugged,db.Model):
     """
         Representative class for an author.
     """
@@ -130,7 +160,7 @@ class Author(db.Model):
         return f'Author({self.name})'
 
 # Finalised
-class Section(db.Model):
+class Section(Slugged,db.Model):
     """
         Representative class for an author.
     """
@@ -155,11 +185,14 @@ class Comment(db.Model):
     """
     __tablename__ = "comment"
 
+    # Comments of a book are paged through newest first.
+    __table_args__ = (db.Index('ix_comment_book_id_id','book_id','id'),)
+
     #Fields
-    user_id = db.Column(db.Integer,db.ForeignKey("user.id"),primary_key=True)
-    book_id = db.Column(db.Integer,db.ForeignKey("book.id"),primary_key=True)
+    id = db.Column(db.Integer,primary_key = True)
+    user_id = db.Column(db.Integer,db.ForeignKey("user.id"),nullable=False,index=True)
+    book_id = db.Column(db.Integer,db.ForeignKey("book.id"),nullable=False)
     content = db.Column(db.Text,nullable=False)
-    id = db.Column(db.Integer,primary_key = True) 
 
     def __repr__(self):
         return f"Comment({self.user_id},{self.book_id})"
@@ -173,8 +206,9 @@ class Rating(db.Model):
     
     #Fields
     book_id = db.Column(db.Integer,db.ForeignKey("book.id"),primary_key=True)
-    user_id = db.Column(db.Integer,db.ForeignKey("user.id"),primary_key=True)
+    user_id = db.Column(db.Integer,db.ForeignKey("user.id"),primary_key=True,index=True)
     score = db.Column(db.Integer, nullable = False)
+    r_date = db.Column(db.DateTime, default = datetime.now, onupdate = datetime.now, index = True)
 
     def __repr__(self):
         return f"Rating({self.user_id},{self.book_id})"
@@ -188,8 +222,8 @@ class Borrow(db.Model):
 
     #Fields
     book_id = db.Column(db.Integer, db.ForeignKey('book.id'), primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
-    b_date = db.Column(db.DateTime, nullable = False, default = date.today())
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True, index=True)
+    b_date = db.Column(db.DateTime, nullable = False, default = date.today(), index = True)
 
     def __repr__(self):
         return f"Borrow({self.user_id},{self.book_id},{self.b_date})"
@@ -203,8 +237,8 @@ class Return(db.Model):
 
     #Fields
     id = db.Column(db.Integer, primary_key=True)
-    book_id = db.Column(db.Integer, db.ForeignKey('book.id'))
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    book_id = db.Column(db.Integer, db.ForeignKey('book.id'), index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), index=True)
     b_date = db.Column(db.DateTime, nullable = False)
     r_date = db.Column(db.DateTime, nullable = False, default = date.today())
 
@@ -222,8 +256,8 @@ class Requested(db.Model):
 
     #Fields
     id = db.Column(db.Integer, primary_key=True)
-    book_id = db.Column(db.Integer, db.ForeignKey('book.id'))
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    book_id = db.Column(db.Integer, db.ForeignKey('book.id'), index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), index=True)
     r_date = db.Column(db.DateTime, nullable = False, default = date.today())
 
     def __repr__(self):
@@ -238,7 +272,7 @@ class Read(db.Model):
 
     #Fields
     book_id = db.Column(db.Integer, db.ForeignKey('book.id'),primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'),primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'),primary_key=True,index=True)
 
     user = db.relationship('User',backref = 'read',lazy=True)
     book = db.relationship('Book',backref = 'read',lazy=True)
@@ -0,0 +1,378 @@
+# Imports
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from flask import current_app,request,render_template,g
+from markupsafe import Markup
+from sqlalchemy import Table,event,inspect
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import operators
+from sqlalchemy.sql.elements import BinaryExpression,BindParameter,BooleanClauseList
+from sqlalchemy.sql.schema import Column
+
+## Page cache for read mostly catalog pages. The main_body block of a page is cached by
+## URL, and the header around it (which names the logged in user) is rendered fresh.
+## Every entry records the rows it was built from, and changes to those rows drop it as
+## soon as the transaction making them commits.
+##
+## A dependency is (table,id,aspect): aspect None is the whole row, ".name" one column
+## of it and "/comment" the comment rows pointing at it. (table,None,None) is a listing
+## of every row of the table.
+
+# Stands for every id of a table when a change cannot be narrowed down to one row.
+ANY = object()
+
+def row(obj,*columns):
+    """Dependency on the row of obj, or only on the given columns of it."""
+    if not columns:
+        return [(obj.__tablename__,obj.id,None)]
+    return [(obj.__tablename__,obj.id,"." + column) for column in columns]
+
+def children(obj,*tables):
+    """Dependency on the rows of the given tables that point at obj."""
+    return [(obj.__tablename__,obj.id,"/" + table) for table in tables]
+
+def listing(model):
+    """Dependency on which rows the table of model holds."""
+    return [(model.__tablename__,None,None)]
+
+## Backends. Both evict the least recently used page once full.
+
+class MemoryBackend:
+    """Pages kept in a dictionary."""
+    def __init__(self,size):
+        self.size = size
+        self.pages = OrderedDict()
+
+    def get(self,key):
+        value = self.pages.get(key)
+        if value is not None:
+            self.pages.move_to_end(key)
+        return value
+
+    def set(self,key,value):
+        """Store a page, returning the keys evicted to make room."""
+        self.pages[key] = value
+        self.pages.move_to_end(key)
+        evicted = []
+        while len(self.pages) > self.size:
+            evicted.append(self.pages.popitem(last=False)[0])
+        return evicted
+
+    def delete(self,key):
+        self.pages.pop(key,None)
+
+class DiskBackend(MemoryBackend):
+    """
+        Pages kept as files, for caches larger than memory allows. Each process uses its
+        own directory since the dependencies are tracked in memory.
+    """
+    def __init__(self,size,directory):
+        super().__init__(size)
+        self.directory = os.path.join(directory,str(os.getpid()))
+        shutil.rmtree(self.directory,ignore_errors=True)
+        os.makedirs(self.directory)
+
+    def _path(self,key):
+        return os.path.join(self.directory,hashlib.sha256(key.encode()).hexdigest())
+
+    def get(self,key):
+        if super().get(key) is None:
+            return None
+        try:
+            with open(self._path(key),encoding="utf-8") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def set(self,key,value):
+        with tempfile.NamedTemporaryFile("w",dir=self.directory,encoding="utf-8",delete=False) as f:
+            f.write(value)
+        os.replace(f.name,self._path(key))
+        evicted = super().set(key,True)
+        for old in evicted:
+            self._remove(old)
+        return evicted
+
+    def delete(self,key):
+        super().delete(key)
+        self._remove(key)
+
+    def _remove(self,key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+class PageCache:
+    """Cached pages with the index of what each depends on, guarded by lock."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.backend = None
+        # Maps table to id to aspect to the keys of the pages depending on it.
+        self.index = {}
+        # Maps key to (expiry time,wrapper template,dependencies).
+        self.entries = {}
+        # Bumped by every invalidation, so pages built from rows read before it are not stored.
+        self.generation = 0
+        # Wall clock time of the last invalidation, for pages built from a replica snapshot.
+        self.invalidated = 0.0
+        self.hits = 0
+        self.misses = 0
+
+    def _backend(self):
+        if self.backend is None:
+            config = current_app.config
+            if config["PAGE_CACHE_DIR"]:
+                self.backend = DiskBackend(config["PAGE_CACHE_SIZE"],config["PAGE_CACHE_DIR"])
+            else:
+                self.backend = MemoryBackend(config["PAGE_CACHE_SIZE"])
+        return self.backend
+
+    def get(self,key):
+        """Return (wrapper template,html) of a cached page, None when it is not cached."""
+        with self.lock:
+            entry = self.entries.get(key)
+            html = self._backend().get(key) if entry and entry[0] > time.monotonic() else None
+            if html is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry[1],html
+
+    def put(self,key,wrapper,html,dependencies,generation,snapshot = None):
+        with self.lock:
+            # Something the page was built from may have changed while it was rendered, or
+            # before the replica snapshot it was read from was taken.
+            if generation != self.generation or (snapshot is not None and snapshot <= self.invalidated):
+                return
+            self._forget(key)
+            self.entries[key] = (time.monotonic() + current_app.config["PAGE_CACHE_TTL"],wrapper,dependencies)
+            for table,id,aspect in dependencies:
+                self.index.setdefault(table,{}).setdefault(id,{}).setdefault(aspect,set()).add(key)
+            for evicted in self._backend().set(key,html):
+                self._forget(evicted)
+
+    def _forget(self,key):
+        entry = self.entries.pop(key,None)
+        if entry is None:
+            return
+        self._backend().delete(key)
+        for table,id,aspect in entry[2]:
+            rows = self.index.get(table,{})
+            aspects = rows.get(id,{})
+            keys = aspects.get(aspect)
+            if keys is None:
+                continue
+            keys.discard(key)
+            if not keys:
+                del aspects[aspect]
+                if not aspects:
+                    del rows[id]
+
+    def invalidate(self,changes):
+        """
+            Drop the pages depending on any of changes, each (table,id,aspects): the row
+            id (ANY for every row) of table, limited to some aspects or None for all of them.
+        """
+        with self.lock:
+            self.generation += 1
+            self.invalidated = time.time()
+            doomed = set()
+            for table,id,aspects in changes:
+                rows = self.index.get(table)
+                if not rows:
+                    continue
+                # The row itself changing also changes the listing of the table.
+                if aspects is None or None in aspects:
+                    doomed.update(*rows.get(None,{}).values())
+                for row_id in (rows if id is ANY else [id]):
+                    if row_id is None:
+                        continue
+                    for aspect,keys in rows.get(row_id,{}).items():
+                        if aspects is None or aspect in aspects:
+                            doomed.update(keys)
+            for key in doomed:
+                self._forget(key)
+
+    def clear(self):
+        with self.lock:
+            self.generation += 1
+            self.invalidated = time.time()
+            for key in list(self.entries):
+                self._forget(key)
+            self.index.clear()
+
+    def size(self):
+        with self.lock:
+            return len(self.entries)
+
+cache = PageCache()
+
+## Views.
+
+def cached(view):
+    """Serve a view from the cache when possible. The view renders through render."""
+    @wraps(view)
+    def inner(*args,**kwargs):
+        if not current_app.config["PAGE_CACHE_SIZE"]:
+            return view(*args,**kwargs)
+        key = request.full_path
+        hit = cache.get(key)
+        if hit:
+            wrapper,html = hit
+            return render_template(wrapper,fragment = Markup(html))
+        g.page_cache = (key,cache.generation)
+        return view(*args,**kwargs)
+    return inner
+
+def render(template_name,dependencies,**context):
+    """
+        Render a page whose main_body block only depends on dependencies, caching that
+        block when the view is wrapped by cached.
+    """
+    template = current_app.jinja_env.get_template(template_name)
+    current_app.update_template_context(context)
+    html = "".join(template.blocks["main_body"](template.new_context(context)))
+
+    # Pages under user_specific/ and librarian_specific/ are framed by their own header.
+    wrapper = template_name.split("/")[0] + "/cached.html"
+    pending = g.pop("page_cache",None)
+    if pending:
+        key,generation = pending
+        cache.put(key,wrapper,html,dependencies,generation,g.get("read_snapshot"))
+    return render_template(wrapper,fragment = Markup(html))
+
+## Invalidation. Writes are turned into changes while a transaction runs and applied
+## once it commits; a rollback discards them.
+
+def _number(value):
+    try:
+        return int(value)
+    except (TypeError,ValueError):
+        return value
+
+def _changes(table,known,columns = None):
+    """
+        Changes made by writing a row of table whose known column values are known.
+        columns names the columns updated, None for an insert or delete.
+    """
+    aspects = None if columns is None else {None} | {"." + c for c in columns}
+    key = list(table.primary_key.columns)
+    id = _number(known[key[0].name]) if len(key) == 1 and key[0].name in known else ANY
+    changes = [(table.name,id,aspects)]
+    for fk in table.foreign_keys:
+        changes.append(_parent(fk,known.get(fk.parent.name,ANY)))
+    return changes
+
+def _parent(fk,value):
+    """Change to the rows of the table of fk pointing at the row value of the table it references."""
+    return (fk.column.table.name,_number(value) if value is not ANY else ANY,{"/" + fk.parent.table.name})
+
+def _pending(session):
+    return session.info.setdefault("page_cache_changes",[])
+
+def _equalities(clause):
+    """Column values pinned by column = value terms ANDed together in clause."""
+    known = {}
+    if clause is None:
+        return known
+    terms = clause.clauses if isinstance(clause,BooleanClauseList) and clause.operator is operators.and_ else [clause]
+    for term in terms:
+        if (isinstance(term,BinaryExpression) and term.operator is operators.eq
+                and isinstance(term.left,Column) and isinstance(term.right,BindParameter)):
+            known[term.left.name] = term.right.effective_value
+    return known
+
+def _columns_of(obj):
+    mapper = inspect(obj).mapper
+    return {column.name: mapper.get_property_by_column(column).key for column in mapper.local_table.columns}
+
+@event.listens_for(Session,"do_orm_execute")
+def _statement(state):
+    if not (state.is_insert or state.is_update or state.is_delete):
+        return
+    stmt = state.statement
+    table = stmt.table
+    # Tables outside the schema, like the search index, back no cached page.
+    if not isinstance(table,Table):
+        return
+    changes = _pending(state.session)
+
+    if state.is_insert:
+        rows = state.parameters if isinstance(state.parameters,list) else [state.parameters or {}]
+        if getattr(stmt,"select",None) is None:
+            values = {c.key if hasattr(c,"key") else c: v for c,v in (getattr(stmt,"_values",None) or {}).items()}
+            values = {k: getattr(v,"effective_value",v) for k,v in values.items()}
+            rows = [dict(values,**row) for row in rows]
+        else:
+            rows = [{}]
+        for row in rows:
+            changes.extend(_changes(table,row))
+        return
+
+    known = _equalities(stmt.whereclause)
+    columns = None
+    if state.is_update:
+        columns = {c.key if hasattr(c,"key") else c for c in (getattr(stmt,"_values",None) or {})} or None
+
+    # A row already loaded in the session tells which rows it points at.
+    key = list(table.primary_key.columns)
+    if len(key) == 1 and key[0].name in known:
+        for obj in state.session.identity_map.values():
+            if getattr(obj,"__table__",None) is table and obj.id == _number(known[key[0].name]):
+                attrs = inspect(obj).dict
+                for name,attr in _columns_of(obj).items():
+                    if name not in known and attr in attrs:
+                        known[name] = attrs[attr]
+                break
+    changes.extend(_changes(table,known,columns))
+
+@event.listens_for(Session,"after_flush")
+def _flush(session,flush_context):
+    changes = _pending(session)
+    for obj,columns in ([(o,None) for o in session.new] + [(o,None) for o in session.deleted]
+                        + [(o,False) for o in session.dirty if session.is_modified(o)]):
+        state = inspect(obj)
+        mapper = state.mapper
+        known,updated = {},set()
+        for name,attr in _columns_of(obj).items():
+            history = state.attrs[attr].history
+            if columns is False and history.has_changes():
+                updated.add(name)
+                # A row moved from one parent to another changes both.
+                for fk in mapper.local_table.columns[name].foreign_keys:
+                    changes.extend(_parent(fk,old) for old in history.deleted if old is not None)
+            value = state.dict.get(attr)
+            if value is not None:
+                known[name] = value
+        if columns is None or updated:
+            changes.extend(_changes(mapper.local_table,known,None if columns is None else updated))
+
+        # Links added or removed through many to many relationships.
+        for prop in mapper.relationships:
+            if prop.secondary is None:
+                continue
+            history = state.attrs[prop.key].history
+            for other in list(history.added) + list(history.deleted):
+                link = {}
+                for parent,column in prop.synchronize_pairs:
+                    link[column.name] = state.dict.get(mapper.get_property_by_column(parent).key)
+                for parent,column in prop.secondary_synchronize_pairs:
+                    link[column.name] = getattr(other,inspect(other).mapper.get_property_by_column(parent).key)
+                changes.extend(_changes(prop.secondary,link))
+
+@event.listens_for(Session,"after_commit")
+def _commit(session):
+    changes = session.info.pop("page_cache_changes",None)
+    if changes:
+        cache.invalidate(changes)
+
+@event.listens_for(Session,"after_rollback")
+def _rollback(session):
+    session.info.pop("page_cache_changes",None)
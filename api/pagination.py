@@ -0,0 +1,102 @@
+# Imports
+import base64
+import json
+from flask import request,url_for,current_app
+from sqlalchemy import tuple_
+
+## Keyset pagination. Pages are cut with WHERE (keys) > (cursor) ... LIMIT on the
+## ordering columns rather than OFFSET, so every page costs the same index seek no
+## matter how deep into the listing it is.
+
+def encode_cursor(values):
+    """Turn the key values of some row into an opaque url safe cursor."""
+    return base64.urlsafe_b64encode(json.dumps(list(values)).encode()).decode()
+
+def decode_cursor(cursor):
+    """
+        Inverse of encode_cursor. Returns None for a malformed cursor, including one
+        holding anything but plain values, which could not be bound as query parameters.
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError,TypeError):
+        return None
+    if not isinstance(values,list) or not all(isinstance(value,(str,int,float)) for value in values):
+        return None
+    return values
+
+class Page:
+    """
+        One page of results along with the cursors of the pages around it. prefix
+        namespaces the query arguments so one view can paginate several listings, and
+        args holds extra arguments to carry over into the previous/next links.
+    """
+    def __init__(self,items,size,next_cursor = None,prev_cursor = None,prefix = "",args = None):
+        self.items = items
+        self.size = size
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.prefix = prefix
+        self.args = args or {}
+
+    def url(self,direction):
+        """Return the link to the next or previous page, None if there is no such page."""
+        cursor = self.next_cursor if direction == "next" else self.prev_cursor
+        if not cursor:
+            return None
+
+        args = dict(request.view_args)
+        args.update(request.args.to_dict())
+        args.update(self.args)
+        for name in ("after","before"):
+            args.pop(self.prefix + name,None)
+        args[self.prefix + ("after" if direction == "next" else "before")] = cursor
+        args[self.prefix + "size"] = self.size
+        return url_for(request.endpoint,**args)
+
+def paginate(query,keys,prefix = "",args = None,descending = False):
+    """
+        Return the Page of query selected by the after/before/size request arguments.
+        keys are the columns the listing is ordered on, which together must be unique.
+        With descending set the listing runs from the highest keys down.
+    """
+    config = current_app.config
+    size = request.args.get(prefix + "size",config["PAGE_SIZE"],type=int)
+    size = max(1,min(size,config["MAX_PAGE_SIZE"]))
+    after = decode_cursor(request.args.get(prefix + "after",""))
+    before = decode_cursor(request.args.get(prefix + "before",""))
+
+    # Ignoring cursors that do not fit this listing.
+    if after is not None and len(after) != len(keys):
+        after = None
+    if before is not None and len(before) != len(keys):
+        before = None
+
+    # Selecting the keys alongside each row so cursors can be built from them.
+    query = query.order_by(None).add_columns(*keys)
+    position = tuple_(*keys)
+    forward = [k.desc() for k in keys] if descending else list(keys)
+    backward = list(keys) if descending else [k.desc() for k in keys]
+
+    def beyond(cursor):
+        return position < tuple_(*cursor) if descending else position > tuple_(*cursor)
+
+    def behind(cursor):
+        return position > tuple_(*cursor) if descending else position < tuple_(*cursor)
+
+    if before:
+        rows = query.filter(behind(before)).order_by(*backward).limit(size + 1).all()
+        more = len(rows) > size
+        rows = rows[:size][::-1]
+        prev_cursor = encode_cursor(rows[0][1:]) if more else None
+        next_cursor = encode_cursor(rows[-1][1:]) if rows else None
+    else:
+        if after:
+            query = query.filter(beyond(after))
+        rows = query.order_by(*forward).limit(size + 1).all()
+        more = len(rows) > size
+        rows = rows[:size]
+        next_cursor = encode_cursor(rows[-1][1:]) if more else None
+        prev_cursor = encode_cursor(rows[0][1:]) if after and rows else None
+
+    return Page([row[0] for row in rows],size,next_cursor,prev_cursor,prefix,args)
@@ -0,0 +1,111 @@
+# Imports
+import multiprocessing
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor,TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+import bcrypt
+from flask import current_app
+
+## Password hashing. bcrypt is made slow on purpose, so at busy times it is what login
+## spends its CPU on. New hashes use BCRYPT_LOG_ROUNDS, and a stored hash of any other
+## cost is replaced at the next successful login, so changing the cost needs no
+## migration. With PASSWORD_HASH_WORKERS set the hashing runs in a pool of that many
+## processes, leaving the request threads of a worker free for every other route.
+## Hashes are the same as Flask-Bcrypt's, so stored passwords keep working.
+
+class Busy(Exception):
+    """Raised when more hashes are waiting than PASSWORD_HASH_QUEUE allows."""
+
+_COST = re.compile(r"^\$2[abxy]?\$(\d\d)\$")
+
+_pool = None
+_slots = None
+_lock = threading.Lock()
+
+def process_context():
+    """
+        How hashing processes are started: from a fork server that only loads bcrypt.
+        Forking this process instead could copy locks held by its other threads into the
+        children and deadlock them.
+    """
+    context = multiprocessing.get_context("forkserver")
+    context.set_forkserver_preload(["bcrypt"])
+    return context
+
+def _executor(config = None):
+    """The process pool and the semaphore bounding its queue, None when hashing inline."""
+    global _pool,_slots
+    config = config or current_app.config
+    workers = config["PASSWORD_HASH_WORKERS"]
+    if not workers:
+        return None,None
+    with _lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers = workers,mp_context = process_context())
+            _slots = threading.BoundedSemaphore(workers + config["PASSWORD_HASH_QUEUE"])
+    return _pool,_slots
+
+def _run(fun,*args):
+    pool,slots = _executor()
+    if pool is None:
+        return fun(*args)
+    timeout = current_app.config["PASSWORD_HASH_TIMEOUT"]
+    if not slots.acquire(timeout = timeout):
+        raise Busy()
+    try:
+        return pool.submit(fun,*args).result(timeout = timeout)
+    except TimeoutError:
+        raise Busy()
+    except BrokenProcessPool:
+        # A worker died. The pool is started again by the next hash, this one is done here.
+        current_app.logger.exception("Password hashing pool broke, hashing inline")
+        _discard(pool)
+        return fun(*args)
+    finally:
+        slots.release()
+
+def _discard(pool):
+    global _pool,_slots
+    with _lock:
+        if _pool is pool:
+            _pool,_slots = None,None
+    pool.shutdown(wait = False)
+
+def _bytes(value):
+    return value.encode("utf-8") if isinstance(value,str) else value
+
+def hash_password(password,rounds = None):
+    """Return the bcrypt hash of password as text, at rounds or BCRYPT_LOG_ROUNDS."""
+    salt = bcrypt.gensalt(rounds or current_app.config["BCRYPT_LOG_ROUNDS"])
+    return _run(bcrypt.hashpw,_bytes(password),salt).decode("utf-8")
+
+def check_password(hashed,password):
+    """Whether password matches the stored hash."""
+    if not hashed:
+        return False
+    try:
+        return _run(bcrypt.checkpw,_bytes(password),_bytes(hashed))
+    except ValueError:
+        # Not a bcrypt hash at all.
+        return False
+
+def cost(hashed):
+    """The cost a stored hash was made with, None if it is not a bcrypt hash."""
+    match = _COST.match(hashed.decode("utf-8") if isinstance(hashed,bytes) else hashed or "")
+    return int(match.group(1)) if match else None
+
+def needs_rehash(hashed):
+    return cost(hashed) != current_app.config["BCRYPT_LOG_ROUNDS"]
+
+def install(app):
+    """Create the hashing pool as the app starts rather than on the first login."""
+    _executor(app.config)
+
+def shutdown():
+    """Stop the pool, for the command line and tests."""
+    global _pool,_slots
+    with _lock:
+        if _pool is not None:
+            _pool.shutdown()
+        _pool,_slots = None,None
@@ -0,0 +1,217 @@
+# Imports
+import heapq
+import math
+import threading
+from array import array
+from bisect import bisect_left
+from itertools import combinations,groupby
+from flask import current_app
+from api import db
+from api.models import Book,Borrow,Read
+from sqlalchemy import union
+
+## "Readers also read" recommendations. Books count as read together when one user has
+## both in the read or borrow table. The co-occurrence counts are built once from the
+## whole history, kept in memory as a sparse book to book matrix and updated as read
+## rows are added, and for every book the RECOMMENDATION_SIZE most similar books are
+## kept ready as a small array. Serving a book page is then a dictionary lookup.
+##
+## Each row of the matrix is a pair of int arrays, the other book ids in order and their
+## counts, about 8 bytes a pair against the 100 odd of nested dictionaries.
+##
+## Similarity is the cosine of the two books' reader sets:
+##     readers of both / sqrt(readers of one * readers of the other)
+##
+## Other workers and the command line do not update this worker's counts, so the
+## matrix is rebuilt every RECOMMENDATION_INTERVAL seconds to catch up. Builds run in the
+## scheduler, the first one when the worker starts, and count on a snapshot of the
+## database without holding the lock. Reads added meanwhile are recorded and replayed
+## onto the new counts when they are swapped in.
+
+# Rows streamed from the history at a time while building.
+YIELD_PER = 10000
+
+def _similar(readers,pairs,book_id):
+    count = readers.get(book_id,0)
+    if not count:
+        return array("i")
+    others,counts = pairs.get(book_id,((),()))
+    scored = ((both / math.sqrt(count * readers[other]),-other) for other,both in zip(others,counts))
+    best = heapq.nlargest(current_app.config["RECOMMENDATION_SIZE"],scored)
+    return array("i",(-negated for _,negated in best))
+
+def _count(readers,pairs,books):
+    """Count one user's books as read together."""
+    for book_id in books:
+        readers[book_id] = readers.get(book_id,0) + 1
+    for a,b in combinations(books,2):
+        row = pairs.setdefault(a,{})
+        row[b] = row.get(b,0) + 1
+        row = pairs.setdefault(b,{})
+        row[a] = row.get(a,0) + 1
+
+def _bump(pairs,book_id,other):
+    others,counts = pairs.setdefault(book_id,(array("i"),array("i")))
+    i = bisect_left(others,other)
+    if i < len(others) and others[i] == other:
+        counts[i] += 1
+    else:
+        others.insert(i,other)
+        counts.insert(i,1)
+
+def _histories(connection,users):
+    """Maps each of users to the books of their read rows."""
+    histories = {}
+    if users:
+        for user_id,book_id in connection.execute(db.select(Read.user_id,Read.book_id).where(Read.user_id.in_(users))):
+            histories.setdefault(user_id,set()).add(book_id)
+    return histories
+
+class Recommender:
+    """Co-occurrence counts and the top neighbours of every book, guarded by lock."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.built = False
+        # Maps book id to the number of readers counted.
+        self.readers = {}
+        # Maps book id to (other book ids in order,readers of both), each pair stored both ways.
+        self.pairs = {}
+        # Maps book id to an array of its most similar book ids, best first.
+        self.neighbours = {}
+        # Maps user id to the books counted from their borrows at build time. Those books
+        # are already counted when the borrow turns into a read row.
+        self.borrowed = {}
+        # (user id,book id) of the reads added while a build runs, None when none does.
+        self.journal = None
+
+    def _recount(self,connection):
+        """Count the whole history seen by connection into new (readers,pairs,borrowed)."""
+        limit = current_app.config["RECOMMENDATION_MAX_HISTORY"]
+        history = union(db.select(Read.user_id,Read.book_id),db.select(Borrow.user_id,Borrow.book_id)).subquery()
+        history = db.select(history).order_by(history.c.user_id).execution_options(yield_per = YIELD_PER)
+
+        readers,pairs,borrowed = {},{},{}
+        result = connection.execute(history)
+        try:
+            for _,rows in groupby(result,key=lambda row: row[0]):
+                books = [book_id for _,book_id in rows]
+                # Readers of everything say little about any pair and cost the square of
+                # their history.
+                if len(books) <= limit:
+                    _count(readers,pairs,books)
+        finally:
+            result.close()
+
+        # Rows are compacted one by one, the dictionaries they replace freed as it goes.
+        for book_id in list(pairs):
+            row = pairs.pop(book_id)
+            others = sorted(row)
+            pairs[book_id] = (array("i",others),array("i",(row[other] for other in others)))
+
+        for user_id,book_id in connection.execute(db.select(Borrow.user_id,Borrow.book_id)):
+            borrowed.setdefault(user_id,set()).add(book_id)
+        return readers,pairs,borrowed
+
+    def build(self):
+        """Recount the whole read and borrow history and swap the new counts in."""
+        with self.lock:
+            if self.journal is not None:
+                return
+            # Opened before the snapshot below, so every read missing from it is recorded.
+            self.journal = []
+        try:
+            with db.engine.connect() as connection:
+                # One read transaction, so every statement sees the same snapshot.
+                if connection.dialect.name == "sqlite":
+                    connection.exec_driver_sql("BEGIN")
+                readers,pairs,borrowed = self._recount(connection)
+                neighbours = {book_id: _similar(readers,pairs,book_id) for book_id in readers}
+
+                with self.lock:
+                    journal,self.journal = self.journal,None
+                    self.readers,self.pairs,self.borrowed,self.neighbours = readers,pairs,borrowed,neighbours
+                    self.built = True
+                    if journal:
+                        # Reads committed before the snapshot are in it already.
+                        journal = list(dict.fromkeys(journal))
+                        histories = _histories(connection,{user_id for user_id,_ in journal})
+                        missing = [(user_id,book_id) for user_id,book_id in journal if book_id not in histories.get(user_id,())]
+                        for user_id,book_id in missing:
+                            histories.setdefault(user_id,set()).add(book_id)
+                        self._apply(missing,histories)
+        finally:
+            with self.lock:
+                self.journal = None
+
+    def _apply(self,reads,histories):
+        """
+            Count reads, a list of new (user id,book id) pairs, given the books of every
+            user's read rows, these included. Called with the lock held.
+        """
+        limit = current_app.config["RECOMMENDATION_MAX_HISTORY"]
+        touched = set()
+        # Reads of the same batch are all in the table already, each is counted against
+        # the ones before it only.
+        pending = {}
+        for user_id,book_id in reads:
+            pending.setdefault(user_id,{})[book_id] = None
+        for user_id,book_id in reads:
+            del pending[user_id][book_id]
+            borrowed = self.borrowed.get(user_id,set())
+            if book_id in borrowed:
+                borrowed.discard(book_id)
+                continue
+            # Everything else of the user's that is already counted.
+            others = (histories.get(user_id,set()) | borrowed) - {book_id} - pending[user_id].keys()
+            if len(others) + 1 > limit:
+                continue
+            self.readers[book_id] = self.readers.get(book_id,0) + 1
+            for other in others:
+                _bump(self.pairs,book_id,other)
+                _bump(self.pairs,other,book_id)
+            touched.add(book_id)
+            touched.update(others)
+        # Books further away only see their scores shift a little, they catch up at the
+        # next rebuild.
+        for book_id in touched:
+            self.neighbours[book_id] = _similar(self.readers,self.pairs,book_id)
+
+    def add_reads(self,reads):
+        """
+            Count newly committed read rows, given as (user id,book id) pairs, and refresh
+            the neighbours of every book touched.
+        """
+        reads = list(dict.fromkeys((int(user_id),int(book_id)) for user_id,book_id in reads))
+        # Before the first build the rows are simply counted by it.
+        if not reads or not (self.built or self.journal is not None):
+            return
+        histories = _histories(db.session,{user_id for user_id,_ in reads})
+        with self.lock:
+            if self.journal is not None:
+                self.journal.extend(reads)
+            if self.built:
+                self._apply(reads,histories)
+
+    def similar(self,book_id):
+        """Ids of the books most read together with book_id, best first. Empty until built."""
+        return self.neighbours.get(book_id,())
+
+    def size(self):
+        """Books with neighbours and stored co-occurrence counts."""
+        return len(self.neighbours),sum(len(others) for others,_ in self.pairs.values())
+
+recommender = Recommender()
+
+def readers_also_read(book_id):
+    """The books most read together with book_id, best first, as (id,name) rows."""
+    ids = list(recommender.similar(int(book_id)))
+    if not ids:
+        return []
+    # Books deleted since the last build drop out here.
+    names = dict(db.session.query(Book.id,Book.name).filter(Book.id.in_(ids)))
+    return [(id,names[id]) for id in ids if id in names]
+
+def rebuild():
+    """Recount the history from scratch. Run by the scheduler to pick up other workers' writes."""
+    recommender.build()
+    return len(recommender.neighbours)
@@ -0,0 +1,128 @@
+# Imports
+import os
+import sqlite3
+import threading
+import time
+from functools import wraps
+from flask import current_app,g,session,has_request_context
+from sqlalchemy import create_engine,event
+from api import db
+from api.database import add_replica
+
+## Read replica. With READ_REPLICA_PATH set, a snapshot of the database is copied there
+## through SQLite's backup API every READ_REPLICA_REFRESH seconds. Routes marked
+## read_only then run their queries on the snapshot, opened read only and immutable, so
+## browsing never queues behind the writer.
+##
+## A route reads from the primary instead when the snapshot is older than
+## READ_REPLICA_MAX_AGE seconds, or when the client has committed anything since the
+## snapshot was taken, so everyone sees their own writes at once whichever worker serves
+## them. Writes made by others show up within READ_REPLICA_MAX_AGE seconds.
+
+class Replica:
+    """The engine open on the current snapshot, guarded by lock."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.engine = None
+        # (inode,mtime) of the snapshot file the engine was opened on.
+        self.opened = None
+
+    def engine_for(self,path,max_age,last_write = 0):
+        """
+            (engine,time the snapshot was taken) to read from, (None,None) when the
+            snapshot is missing, older than max_age or taken before last_write.
+        """
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None,None
+        # The snapshot file's mtime is set to when it was taken.
+        taken = stat.st_mtime
+        if time.time() - taken > max_age or last_write >= taken:
+            return None,None
+        with self.lock:
+            if self.opened != (stat.st_ino,stat.st_mtime):
+                # Connections still on the old file close as they are returned.
+                if self.engine is not None:
+                    self.engine.dispose()
+                self.engine = create_engine(f"sqlite:///file:{os.path.abspath(path)}?mode=ro&immutable=1&uri=true")
+                # Counted, timed and budgeted like queries on the primary.
+                add_replica(self.engine)
+                self.opened = (stat.st_ino,stat.st_mtime)
+            return self.engine,taken
+
+replica = Replica()
+
+def refresh(force = False):
+    """
+        Take a new snapshot of the primary into READ_REPLICA_PATH, unless another worker
+        took one during the last half interval. Returns whether a snapshot was taken.
+    """
+    config = current_app.config
+    path = config["READ_REPLICA_PATH"]
+    if not path:
+        return False
+    try:
+        if not force and time.time() - os.stat(path).st_mtime < config["READ_REPLICA_REFRESH"] / 2:
+            return False
+    except FileNotFoundError:
+        pass
+    os.makedirs(os.path.dirname(os.path.abspath(path)),exist_ok=True)
+    temporary = f"{path}.{os.getpid()}.tmp"
+
+    taken = time.time()
+    source = db.engine.raw_connection()
+    try:
+        target = sqlite3.connect(temporary)
+        try:
+            source.driver_connection.backup(target)
+            # Read only connections cannot open a WAL database without its side files.
+            target.execute("PRAGMA journal_mode = DELETE")
+        finally:
+            target.close()
+    finally:
+        source.close()
+
+    # Replaced whole rather than written into, so open snapshots never change under
+    # their readers, which is what lets them be opened as immutable.
+    os.utime(temporary,(taken,taken))
+    os.replace(temporary,path)
+
+    elapsed = time.time() - taken
+    if elapsed > config["READ_REPLICA_REFRESH"] / 2:
+        current_app.logger.warning(f"Read replica snapshot took {elapsed:.1f}s, raise READ_REPLICA_REFRESH and READ_REPLICA_MAX_AGE")
+    return True
+
+def read_only(view):
+    """Run the queries of view on the read replica when it is fresh enough."""
+    @wraps(view)
+    def inner(*args,**kwargs):
+        config = current_app.config
+        if not config["READ_REPLICA_PATH"]:
+            return view(*args,**kwargs)
+        g.read_engine,g.read_snapshot = replica.engine_for(config["READ_REPLICA_PATH"],config["READ_REPLICA_MAX_AGE"],session.get("last_write",0))
+        if g.read_engine is None:
+            return view(*args,**kwargs)
+        # The session and its identity map are shared with primary reads. Everything in
+        # it is expired on the way in and out, so the view reads the snapshot throughout
+        # and nothing loaded from it is handed to later queries as if current.
+        db.session.expire_all()
+        try:
+            return view(*args,**kwargs)
+        finally:
+            db.session.expire_all()
+            g.pop("read_engine",None)
+            g.pop("read_snapshot",None)
+    return inner
+
+def _committed(conn):
+    # Remembered in the session cookie, so it follows the client to every worker.
+    if has_request_context():
+        session["last_write"] = time.time()
+
+def install(app):
+    """Track the commits of each client and take a first snapshot."""
+    if not app.config["READ_REPLICA_PATH"]:
+        return
+    event.listen(db.engine,"commit",_committed)
+    refresh(force = True)
@@ -0,0 +1,295 @@
+# Imports
+import json
+from datetime import timedelta
+from functools import wraps
+from flask import Blueprint,request,current_app,make_response
+from flask_login import current_user
+from flask_restful import Api,Resource,fields,marshal,abort
+from api import db
+from api.models import Book,Author,Section,Comment,Rating,Borrow,written,category
+from api.pagination import paginate
+from api import loaders
+from api.replica import read_only
+
+## JSON API under /api/v1, read only, for clients that would otherwise scrape pages.
+## Logged in through the same session cookie as the site.
+##
+## Listings are keyset paginated like the librarian pages (?size=, then the next and
+## prev links of each page) and take ?ids=1,2,3 to fetch those rows in one go instead.
+## Every resource takes ?fields=a,b to return only some fields. Responses carry an
+## ETag, and a request sending it back in If-None-Match gets an empty 304.
+##
+## Every resource reads from the read replica when one is configured, see
+## api/replica.py. That holds for the personal listings (comments, ratings, loans) as
+## well, since a client that has written anything since the last snapshot reads from
+## the primary and so always sees their own writes.
+
+blueprint = Blueprint("api_v1",__name__,url_prefix="/api/v1")
+api = Api(blueprint)
+
+@api.representation("application/json")
+def output_json(data,code,headers = None):
+    response = make_response(json.dumps(data,separators=(",",":")),code)
+    response.headers.extend(headers or {})
+    response.mimetype = "application/json"
+    if code == 200:
+        # Contents depend on who asks, so only their own client may keep a copy, and it
+        # has to check back before reusing it.
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        response.vary.add("Cookie")
+        response.add_etag()
+        response.make_conditional(request)
+    return response
+
+def authenticated(fun):
+    @wraps(fun)
+    def inner(*args,**kwargs):
+        if current_user.is_anonymous:
+            abort(401,message="Login required")
+        return fun(*args,**kwargs)
+    return inner
+
+## Helpers shared by the resources.
+
+def _selected(available):
+    """The fields named by ?fields=, all of available without it."""
+    names = request.args.get("fields")
+    if not names:
+        return available
+    selected = {}
+    for name in names.split(","):
+        if name not in available:
+            abort(400,message=f"Unknown field {name}, expected some of {','.join(available)}")
+        selected[name] = available[name]
+    return selected
+
+def _ids():
+    """The ids asked for with ?ids=, None when not fetching a batch."""
+    raw = request.args.get("ids")
+    if raw is None:
+        return None
+    try:
+        ids = list(dict.fromkeys(int(id) for id in raw.split(",") if id))
+    except ValueError:
+        abort(400,message="ids must be a comma separated list of integers")
+    if len(ids) > current_app.config["MAX_PAGE_SIZE"]:
+        abort(400,message=f"At most {current_app.config['MAX_PAGE_SIZE']} ids at once")
+    return ids
+
+def _int_arg(name):
+    value = request.args.get(name)
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        abort(400,message=f"{name} must be an integer")
+
+def _dump(rows,available,related):
+    """
+        Marshal rows to the selected fields. related maps the fields that are loaded
+        separately to a function taking the ids of rows and returning id to value, so a
+        page costs one query per related field rather than one per row.
+    """
+    selected = _selected(available)
+    items = marshal(rows,{name: field for name,field in selected.items() if name not in related})
+    for name in selected:
+        if name in related:
+            values = related[name]([row.id for row in rows])
+            for row,item in zip(rows,items):
+                item[name] = values.get(row.id,[])
+    return items
+
+def _listing(query,keys,available,related = {},id_column = None,descending = False):
+    """
+        Body of a listing: a page of query ordered by keys, or the rows whose id_column
+        is in ?ids=. Listings without an id_column cannot be fetched by ids.
+    """
+    ids = _ids()
+    if ids is not None:
+        if id_column is None:
+            abort(400,message="This listing cannot be fetched by ids")
+        found = {getattr(row,id_column.key): row for row in query.filter(id_column.in_(ids))}
+        rows = [found[id] for id in ids if id in found]
+        return {"items": _dump(rows,available,related)}
+
+    page = paginate(query,keys,descending = descending)
+    return {"items": _dump(page.items,available,related),"next": page.url("next"),"prev": page.url("prev")}
+
+def _single(model,id,available,related = {}):
+    obj = db.session.get(model,id)
+    if obj is None:
+        abort(404,message=f"No {model.__tablename__} {id}")
+    return _dump([obj],available,related)[0]
+
+def _links(table,column,other):
+    """Loader of related id lists through a link table, for _dump."""
+    def load(ids):
+        values = {}
+        for id,linked in db.session.query(table.c[column],table.c[other]).filter(table.c[column].in_(ids)).order_by(table.c[other]):
+            values.setdefault(id,[]).append(linked)
+        return values
+    return load
+
+def _own(user_id):
+    """The user id a listing of personal rows is limited to. Librarians may ask for anyone's or everyone's."""
+    if current_user.is_librarian:
+        return user_id
+    if user_id is not None and user_id != current_user.id:
+        abort(403,message="Only librarians may see other users' rows")
+    return current_user.id
+
+## Resources.
+
+BOOK_FIELDS = {
+    "id": fields.Integer,
+    "name": fields.String,
+    "description": fields.String,
+    "rating": fields.Float(attribute=lambda book: book.get_rating()),
+    "rating_count": fields.Integer,
+    "authors": None,
+    "sections": None,
+}
+BOOK_RELATED = {
+    "authors": _links(written,"book_id","author_id"),
+    "sections": _links(category,"book_id","section_id"),
+}
+
+AUTHOR_FIELDS = {
+    "id": fields.Integer,
+    "name": fields.String,
+    "bio": fields.String,
+    "books": None,
+}
+AUTHOR_RELATED = {"books": _links(written,"author_id","book_id")}
+
+SECTION_FIELDS = {
+    "id": fields.Integer,
+    "name": fields.String,
+    "description": fields.String,
+    "created": fields.DateTime(dt_format="iso8601",attribute="doc"),
+    "books": None,
+}
+SECTION_RELATED = {"books": _links(category,"section_id","book_id")}
+
+COMMENT_FIELDS = {
+    "id": fields.Integer,
+    "book_id": fields.Integer,
+    "user_id": fields.Integer,
+    "username": fields.String(attribute="user.username"),
+    "content": fields.String,
+}
+
+RATING_FIELDS = {
+    "book_id": fields.Integer,
+    "user_id": fields.Integer,
+    "score": fields.Integer,
+    "date": fields.DateTime(dt_format="iso8601",attribute="r_date"),
+}
+
+LOAN_FIELDS = {
+    "book_id": fields.Integer,
+    "user_id": fields.Integer,
+    "borrowed": fields.DateTime(dt_format="iso8601",attribute="b_date"),
+    "due": fields.DateTime(dt_format="iso8601",attribute=lambda loan: loan.b_date + timedelta(days=current_app.config["LOAN_DAYS"])),
+}
+
+class BookList(Resource):
+    method_decorators = [read_only,authenticated]
+
+    def get(self):
+        query = Book.query
+        author_id,section_id = _int_arg("author_id"),_int_arg("section_id")
+        if author_id is not None:
+            query = query.filter(Book.id.in_(db.select(written.c.book_id).where(written.c.author_id == author_id)))
+        if section_id is not None:
+            query = query.filter(Book.id.in_(db.select(category.c.book_id).where(category.c.section_id == section_id)))
+        return _listing(query,[Book.id],BOOK_FIELDS,BOOK_RELATED,Book.id)
+
+class BookItem(Resource):
+    method_decorators = [read_only,authenticated]
+
+    def get(self,id):
+        return _single(Book,id,BOOK_FIELDS,BOOK_RELATED)
+
+class AuthorList(Resource):
+    method_decorators = [read_only,authenticated]
+
+    def get(self):
+        return _listing(Author.query,[Author.id],AUTHOR_FIELDS,AUTHOR_RELATED,Author.id)
+
+class AuthorItem(Resource):
+    method_decorators = [read_only,authenticated]
+
+    def get(self,id):
+        return _single(Author,id,AUTHOR_FIELDS,AUTHOR_RELATED)
+
+class SectionList(Resource):
+    method_decorators = [read_only,authenticated]
+
+    def get(self):
+        return _listing(Section.query,[Section.id],SECTION_FIELDS,SECTION_RELATED,Section.id)
+
+class SectionItem(Resource):
+    method_decorators = [read_only,authenticated]
+
+    def get(self,id):
+        return _single(Section,id,SECTION_FIELDS,SECTION_RELATED)
+
+class CommentList(Resource):
+    """Comments, newest first, optionally on one book or by one user."""
+    method_decorators = [read_only,authenticated]
+
+    def get(self):
+        query = Comment.query.options(*loaders.COMMENTS)
+        book_id,user_id = _int_arg("book_id"),_int_arg("user_id")
+        if book_id is not None:
+            query = query.filter(Comment.book_id == book_id)
+        if user_id is not None:
+            query = query.filter(Comment.user_id == user_id)
+        return _listing(query,[Comment.id],COMMENT_FIELDS,id_column = Comment.id,descending = True)
+
+class RatingList(Resource):
+    """
+        The ratings given by the logged in user, or by anyone for librarians. The ids of a
+        batch are book ids, so batches need a single user.
+    """
+    method_decorators = [read_only,authenticated]
+
+    def get(self):
+        query = Rating.query
+        book_id,user_id = _int_arg("book_id"),_own(_int_arg("user_id"))
+        if book_id is not None:
+            query = query.filter(Rating.book_id == book_id)
+        if user_id is not None:
+            query = query.filter(Rating.user_id == user_id)
+        return _listing(query,[Rating.user_id,Rating.book_id],RATING_FIELDS,
+                        id_column = Rating.book_id if user_id is not None else None)
+
+class LoanList(Resource):
+    """
+        Books borrowed by the logged in user, or by anyone for librarians, with their due
+        dates. The ids of a batch are book ids, so batches need a single user.
+    """
+    method_decorators = [read_only,authenticated]
+
+    def get(self):
+        query = Borrow.query
+        book_id,user_id = _int_arg("book_id"),_own(_int_arg("user_id"))
+        if book_id is not None:
+            query = query.filter(Borrow.book_id == book_id)
+        if user_id is not None:
+            query = query.filter(Borrow.user_id == user_id)
+        return _listing(query,[Borrow.user_id,Borrow.book_id],LOAN_FIELDS,
+                        id_column = Borrow.book_id if user_id is not None else None)
+
+api.add_resource(BookList,"/books")
+api.add_resource(BookItem,"/books/<int:id>")
+api.add_resource(AuthorList,"/authors")
+api.add_resource(AuthorItem,"/authors/<int:id>")
+api.add_resource(SectionList,"/sections")
+api.add_resource(SectionItem,"/sections/<int:id>")
+api.add_resource(CommentList,"/comments")
+api.add_resource(RatingList,"/ratings")
+api.add_resource(LoanList,"/loans")
@@ -1,8 +1,22 @@
 # Imports
-from flask import request,render_template,flash,redirect,url_for
-from api import app,db,bcrypt,login_manager
+from flask import request,render_template,flash,redirect,url_for,g,jsonify,Response,stream_with_context,abort
+from api import app,db,login_manager
 from api.forms import *
 from api.models import *
+from api import trending as leaderboards
+from api import search as search_index
+from api import loaders
+from api import loans
+from api import user_cache
+from api import exports
+from api import storage
+from api import page_cache
+from api import recommendations
+from api import passwords
+from api.page_cache import row,children,listing
+from api.pagination import paginate
+from api import instrumentation
+from api.replica import read_only
 from flask_login import login_user,logout_user,current_user
 from functools import wraps
 from sqlalchemy import insert,func
@@ -10,12 +24,22 @@ from datetime import timedelta,datetime
 
 ## Utility functions!
 
+# Helper function returning the page of comments on a book asked for, newest first.
+def book_comments(book_id):
+    query = Comment.query.options(*loaders.COMMENTS).filter(Comment.book_id == book_id)
+    return paginate(query,[Comment.id],prefix="comments_",descending=True)
+
 # Helper function called internally to login correct user.
 # Tested OK - Gamma
 @login_manager.user_loader
 def load_user(user_id):
-    user = User.query.filter_by(id=user_id).first()
-    return user
+    return user_cache.get(user_id)
+
+# Helper function dropping the user Flask-Login keeps on g once a request ends. The app
+# context pushed at startup outlives requests made in the same thread, and with it g.
+@app.teardown_request
+def forget_loaded_user(exception):
+    g.pop("_login_user",None)
 
 # Helper function called internally to display content for pages that do not exist.
 # Tested OK - Gamma
@@ -49,6 +73,9 @@ def normal_user_required(fun):
 # Tested OK - Gamma
 @app.route("/")
 def home():
+    # Normal users land on their profile, which walks every loan and its book.
+    if not current_user.is_anonymous and not current_user.is_librarian:
+        User.query.options(*loaders.PROFILE).populate_existing().filter(User.id == current_user.id).one()
     return render_template("base_templates/home.html")
 
 ## Global user routes
@@ -63,22 +90,24 @@ def login():
         
         u = User.query.filter_by(email=form.email.data).first()
 
-        if u and bcrypt.check_password_hash(u.password,form.password.data):
-            res = login_user(u)
-
-            # Remove expired books from user on login
-            for b in current_user.borrowed:
-                if (datetime.now() - b.b_date).days > 7:
-                    obj = b
-                    try:
-                        db.session.add(Read(user_id = obj.user_id, book_id = obj.book_id))
-                        db.session.commit()
-                    except Exception:
-                        db.session.rollback()
-                    
-                    Borrow.query.filter(Borrow.user_id == obj.user_id).filter(Borrow.book_id == obj.book_id).delete()
+        try:
+            valid = u and passwords.check_password(u.password,form.password.data)
+        except passwords.Busy:
+            flash("Too many logins right now, please try again in a moment",category="danger")
+            return render_template("anon_specific/login.html",login_user_form = form),503
+
+        if valid:
+            # Bringing the stored hash to the configured cost while the password is at hand.
+            if passwords.needs_rehash(u.password):
+                try:
+                    u.password = passwords.hash_password(form.password.data)
                     db.session.commit()
+                except passwords.Busy:
+                    db.session.rollback()
+
+            res = login_user(u)
 
+            # Expired books are removed by the background expiry job, see api/tasks.py
             return redirect(url_for('home'))
 
         else:
@@ -97,12 +126,18 @@ def register():
 
     if form.validate_on_submit():
 
-        hashed_password = bcrypt.generate_password_hash(form.password.data)
+        try:
+            hashed_password = passwords.hash_password(form.password.data)
+        except passwords.Busy:
+            flash("Too many sign ups right now, please try again in a moment",category="danger")
+            return render_template("anon_specific/register.html",register_user_form = form),503
         u = User(username=form.username.data,email=form.email.data,password=hashed_password)
         created = 0
         try:
             #Creating user.
             db.session.add(u)
+            db.session.flush()
+            search_index.index(u)
             db.session.commit()
             created = 1
 
@@ -136,41 +171,44 @@ def logout():
 # Tested OK- Gamma
 @app.route("/sections")
 @normal_user_required
+@page_cache.cached
+@read_only
 def genre():
     sections = Section.query.all()
-    return render_template('user_specific/sections.html',sections=sections)
+    return page_cache.render('user_specific/sections.html',listing(Section),sections=sections)
 
 # Route to see a specific section by name.
 # Tested OK - Gamma
 @app.route("/sections/<name>")
 @normal_user_required
+@page_cache.cached
+@read_only
 def selected_genre(name):
-    section = Section.query.filter(func.lower(Section.name) == name.lower()).scalar()
+    section = Section.query.options(*loaders.SECTION).filter(Section.slug == slugify(name)).scalar()
     if not section:
         return render_template('user_specific/non_existant.html')
-    return render_template('user_specific/specific_section.html',genre = section)
+    dependencies = row(section) + children(section,"category") + [d for b in section.books for d in row(b,"name")]
+    return page_cache.render('user_specific/specific_section.html',dependencies,genre = section)
 
 # Route to see recently added and highly rated books.
 # Tested OK - Gamma
 @app.route("/trending")
 @normal_user_required
+@read_only
 def trending():
-    all_books = Book.query.order_by(Book.id).all()
+    N = app.config["TRENDING_SIZE"]
+    days = app.config["TRENDING_WINDOW_DAYS"]
+    if "days" in request.args:
+        # Anything but one of the configured windows, including no number at all, is refused.
+        days = request.args.get("days",0,type=int)
+    if days not in leaderboards.windows():
+        abort(400)
 
-    # Get last added five books with most recent book first.
-    new_books = all_books[-5::]
-    new_books = new_books[::-1]
-    
-    # Get top N books.
-    N = 5
-    top_books = []
-    for book in all_books:
-        top_books.append((book.get_rating(),book))
-        if len(top_books) > N:
-            top_books.sort(reverse=True)
-            top_books.pop()
+    # Both lists are computed in the database and served from the leaderboard cache.
+    new_books = leaderboards.leaderboard("newest",N)
+    top_books = [(entry.rating,entry) for entry in leaderboards.leaderboard("top",N,days)]
 
-    return render_template('user_specific/trending.html', new_books = new_books,top_books = top_books)
+    return render_template('user_specific/trending.html', new_books = new_books,top_books = top_books, days = days)
 
 # Route to see a particular book.
 # Tested OK - Gamma
@@ -183,7 +221,7 @@ def selected_book(id):
         return render_template('user_specific/non_existant.html')
     
     # Info related to rating and number of ratings
-    num_ratings = len(list(curr_book.ratings))
+    num_ratings = curr_book.rating_count
     avg_score = curr_book.get_rating()
     your_score = Rating.query.filter(Rating.book_id == curr_book.id).filter(Rating.user_id == current_user.id).scalar()
     if your_score:
@@ -194,65 +232,41 @@ def selected_book(id):
     # 2: Insufficient space / Awaiting return
     # 1: Already requested
     # 0: Already borrowed
-    state = 3
-
-    if len(current_user.borrowed) + len(current_user.requested) + len(current_user.returned) >= 5:
-        state = 2
-
-    # Check if currently borrowed.
-    return_date = None
-    for b in current_user.borrowed:
-        if b.book.name == curr_book.name:
-            state = 0
-            return_date = b.b_date + timedelta(days=7)
-            return_date = return_date.__str__()
-            return_date = return_date[:10:]
-            break
-    
-    # Check if currently requested.
-    for b in current_user.requested:
-        if b.book.name == curr_book.name:
-            state = 1
-            break
-
-    # Check if currently returned and awaiting processing.
-    for b in current_user.returned:
-        if b.book.name == curr_book.name:
-            state = 2
-            break
+    loan = loans.loan_state(current_user.id,curr_book.id)
+    state = loan.state
+    return_date = loan.return_date
+
+    # Newest comments first, a page at a time.
+    comments_page = book_comments(curr_book.id)
+
+    # Books most often read by readers of this one, from the precomputed index.
+    also_read = recommendations.readers_also_read(curr_book.id)
 
     return render_template('user_specific/book.html',book=curr_book,
                             avg_score = avg_score, your_score = your_score,
-                            state = state, return_date=return_date, num_ratings = num_ratings)
+                            state = state, return_date=return_date, num_ratings = num_ratings,
+                            comments_page = comments_page, also_read = also_read)
 
 # Route to read a particular book.
 # Tested OK - Gamma
 @app.route("/read",methods = ["POST"])
 @normal_user_required
 def read():
-    book_id = request.form.get("book_id")
-    
-    # Sanity check for book being actually borrowed.
-    owned = 0
-    for b in current_user.borrowed:
-        if b.book.id == int(book_id):
-            owned = 1
-            break
+    return redirect(url_for("read_book",id = request.form.get("book_id")))
 
-    if not owned:
+# Route serving the file of a borrowed book. Readers fetch parts of large files with Range requests.
+@app.route("/read/<int:id>")
+@normal_user_required
+def read_book(id):
+    # Sanity check for book being actually borrowed.
+    if not Borrow.query.filter(Borrow.book_id == id).filter(Borrow.user_id == current_user.id).scalar():
         return app.login_manager.unauthorized()
     
-    book = Book.query.filter(Book.id == book_id).scalar()
-    if not book:
-        return render_template('user_specific/non_existant.html')
-    
-    src = Content.query.filter(Content.book_id == book_id).scalar()
-    if src:
-        src = src.filename
-    else:
+    src = Content.query.filter(Content.book_id == id).scalar()
+    if not src:
         return render_template('user_specific/non_existant.html')
 
-    return redirect(src)
+    return storage.serve(src.filename)
 
 #Route to request a particular book
 # Tested OK - Gamma
@@ -263,7 +277,7 @@ def request_book():
     user_id = current_user.id
 
     # Sanity check in case of POST request being sent
-    if len(current_user.requested) + len(current_user.borrowed) + len(current_user.returned) >= 5:
+    if loans.loan_state(user_id).at_limit:
         return app.login_manager.unauthorized()
 
     # Adding the request object. Checking for duplicates just in case.
@@ -321,16 +335,27 @@ def _return():
 @normal_user_required
 def rate():
     book_id = request.form.get("book_id")
-    score = request.form.get("score")
+    # The form only offers 1 to 5, and anything else would skew the book's aggregates.
+    score = request.form.get("score",type=int)
+    if score is None or not 1 <= score <= 5:
+        abort(400)
     user_id = current_user.id
 
+    book = Book.query.filter(Book.id == book_id).scalar()
+    if not book:
+        return render_template('user_specific/non_existant.html')
+
     # Checking if record exists and overwriting as necessary.
+    # Aggregates on the book are updated in the same transaction.
     record = Rating.query.filter(Rating.book_id == book_id).filter(Rating.user_id == user_id).scalar()
     if record:
+        book.record_rating(score,previous = record.score)
         record.score = score
     else:
+        book.record_rating(score)
         db.session.add(Rating(book_id = book_id, user_id = user_id, score = score))
     db.session.commit()
+    leaderboards.invalidate()
 
     return redirect(url_for("selected_book",id=book_id))
 
@@ -343,13 +368,8 @@ def comment():
     content = request.form.get("content")
     user_id = current_user.id
 
-    # Computing id of new comment.
-    highest_id = db.session.query(func.max(Comment.id)).scalar()
-    if not highest_id:
-        highest_id = 1
-
-    # Adding Comment object.
-    obj = Comment(id = highest_id + 1, book_id = book_id, user_id = user_id, content = content)
+    # Adding Comment object, the database assigns its id.
+    obj = Comment(book_id = book_id, user_id = user_id, content = content)
     db.session.add(obj)
     db.session.commit()
 
@@ -377,11 +397,14 @@ def remove_own_comment(id):
 # Tested OK - Gamma
 @app.route("/author/<id>")
 @normal_user_required
+@page_cache.cached
+@read_only
 def selected_author(id):
-    author = Author.query.filter(id == Author.id).scalar()
+    author = Author.query.options(*loaders.AUTHOR).filter(id == Author.id).scalar()
     if not author:
         return render_template('user_specific/non_existant.html')
-    return render_template('user_specific/author.html',author=author)
+    dependencies = row(author) + children(author,"written") + [d for b in author.books for d in row(b,"name")]
+    return page_cache.render('user_specific/author.html',dependencies,author=author)
 
 # Route to search for some book.
 # Tested OK - Gamma
@@ -393,12 +416,18 @@ def search():
     if form.validate_on_submit():
         book_name,author_name,section_name = form.book_name.data,form.author_name.data,form.section_name.data
         
-        # Applying Criteria
-        result = Book.query.filter(Book.name.ilike(f"%{book_name}%"))
-        result = result.filter(Book.authors.any(Author.name.ilike(f"%{author_name}%")))
-        result = result.filter(Book.sections.any(name=section_name))
+        # Applying Criteria through the full text index. Empty fields do not filter.
+        if book_name:
+            result = search_index.search(Book,book_name)
+        else:
+            result = Book.query.order_by(Book.name)
 
-        result = result.order_by(Book.name).all()
+        if author_name:
+            result = result.filter(Book.authors.any(Author.id.in_(search_index.matching_ids(Author,author_name))))
+        if section_name:
+            result = result.filter(Book.sections.any(Section.id.in_(search_index.matching_ids(Section,section_name))))
+
+        result = result.all()
         if result:
             return render_template("user_specific/results.html",results = result)
         else:
@@ -419,43 +448,73 @@ def browse():
 # Tested OK - Gamma
 @app.route("/librarian/users")
 @librarian_required
+@read_only
 def see_users():
-    users = User.query.order_by(User.username).all()
-    # Jinja2 handles not displaying librarian users.
-    return render_template("librarian_specific/all_users.html",users = users)
+    page = paginate(User.query.filter(User.is_librarian == 0),[User.username])
+    return render_template("librarian_specific/all_users.html",users = page.items,page = page)
 
 # Route to see all sections.
 # Tested OK - Gamma
 @app.route("/librarian/sections")
 @librarian_required
+@read_only
 def see_sections():
-    sections = Section.query.order_by(Section.name).all()
-    return render_template("librarian_specific/all_sections.html",sections = sections)
+    page = paginate(Section.query,[Section.name])
+    return render_template("librarian_specific/all_sections.html",sections = page.items,page = page)
 
 # Route to see all books.
 # Tested OK - Gamma
 @app.route("/librarian/books")
 @librarian_required
+@read_only
 def see_books():
-    books = Book.query.order_by(Book.name).all()
-    return render_template("librarian_specific/all_books.html",books = books)
+    page = paginate(Book.query,[Book.name])
+    return render_template("librarian_specific/all_books.html",books = page.items,page = page)
 
 # Route to see all authors.
 # Tested OK - Gamma
 @app.route("/librarian/authors")
 @librarian_required
+@read_only
 def see_authors():
-    authors = Author.query.all()
-    return render_template("librarian_specific/all_authors.html",authors = authors)
+    page = paginate(Author.query,[Author.name])
+    return render_template("librarian_specific/all_authors.html",authors = page.items,page = page)
 
 # Route to see all requests.
 # Tested OK - Gamma
 @app.route("/librarian/requests")
 @librarian_required
 def see_requests():
-    requests = Requested.query.all()
-    returned = Return.query.all()
-    return render_template("librarian_specific/all_requests.html",requests = requests, returned = returned)
+    # Both queues are paginated independently, oldest first.
+    requests_page = paginate(Requested.query.options(*loaders.ALL_REQUESTS),[Requested.id],prefix = "requests_")
+    returns_page = paginate(Return.query.options(*loaders.ALL_RETURNS),[Return.id],prefix = "returns_")
+    return render_template("librarian_specific/all_requests.html",requests = requests_page.items, returned = returns_page.items,
+                           requests_page = requests_page, returns_page = returns_page)
+
+# Route to see per endpoint query counts and timings.
+@app.route("/librarian/stats")
+@librarian_required
+def see_stats():
+    stats = instrumentation.snapshot()
+    return render_template("librarian_specific/stats.html",stats = stats,enabled = app.config["INSTRUMENTATION"],
+                           user_cache = user_cache.counters,cached_users = user_cache.size(),
+                           page_cache = page_cache.cache,cached_pages = page_cache.cache.size())
+
+# Route to list the circulation exports.
+@app.route("/librarian/exports")
+@librarian_required
+def see_exports():
+    return render_template("librarian_specific/exports.html",kinds = exports.EXPORTS,formats = exports.FORMATS)
+
+# Route to download a circulation table, streamed as it is read.
+@app.route("/librarian/export/<kind>.<format>")
+@librarian_required
+def export(kind,format):
+    if kind not in exports.EXPORTS or format not in exports.FORMATS:
+        abort(404)
+    response = Response(stream_with_context(exports.export(kind,format)),mimetype = exports.FORMATS[format])
+    response.headers["Content-Disposition"] = f"attachment; filename={kind}.{format}"
+    return response
 
 # Route to handle a return requests.
 # Tested OK - Gamma
@@ -467,6 +526,7 @@ def handled_return(id):
     if not obj:
         return render_template('librarian_specific/non_existant.html')
     
+    read = (obj.user_id,obj.book_id)
     try:
         # Adding the Read object
         db.session.add(Read(user_id=obj.user_id,book_id=obj.book_id))
@@ -475,6 +535,9 @@ def handled_return(id):
     except Exception as E:
         db.session.rollback()
 
+    else:
+        recommendations.recommender.add_reads([read])
+
     # Deleting the Return object
     res.delete()
     db.session.commit()
@@ -488,24 +551,35 @@ def handled_return(id):
 def find_something():
     form = LibrarianSearchForm()
 
+    # Later pages of results come back as GET requests carrying the search in the URL.
     if form.validate_on_submit():
-        if form.obj_type.data == "Book":
-            results = Book.query.filter(Book.name.ilike(f"%{form.obj_name.data}%")).order_by(Book.name).all()
-            return render_template("librarian_specific/all_books.html",books = results)
+        obj_type,obj_name = form.obj_type.data,form.obj_name.data
+    else:
+        obj_type,obj_name = request.args.get("obj_type"),request.args.get("obj_name")
+
+    if obj_name:
+        search = {"obj_type": obj_type, "obj_name": obj_name}
 
-        elif form.obj_type.data == "User":
-            results = User.query.filter(User.username.ilike(f"%{form.obj_name.data}%")).order_by(User.username).all()
-            return render_template("librarian_specific/all_users.html", users = results)
+        # Results come ranked from the full text index.
+        if obj_type == "Book":
+            query,rank = search_index.ranked_search(Book,obj_name)
+            page = paginate(query,[rank,Book.id],args = search)
+            return render_template("librarian_specific/all_books.html",books = page.items,page = page)
+
+        elif obj_type == "User":
+            query,rank = search_index.ranked_search(User,obj_name)
+            page = paginate(query,[rank,User.id],args = search)
+            return render_template("librarian_specific/all_users.html", users = page.items,page = page)
         
-        elif form.obj_type.data == "Section":
-            results = Section.query.filter(Section.name.ilike(f"%{form.obj_name.data}%")).order_by(Section.name).all()
-            return render_template("librarian_specific/all_sections.html", sections = results)
+        elif obj_type == "Section":
+            query,rank = search_index.ranked_search(Section,obj_name)
+            page = paginate(query,[rank,Section.id],args = search)
+            return render_template("librarian_specific/all_sections.html", sections = page.items,page = page)
         
-        elif form.obj_type.data == "Author":
-            results = Author.query.filter(Author.name.ilike(f"%{form.obj_name.data}%")).order_by(Author.name).all()
-            return render_template("librarian_specific/all_authors.html",authors = results)
-        else:
-            results = None
+        elif obj_type == "Author":
+            query,rank = search_index.ranked_search(Author,obj_name)
+            page = paginate(query,[rank,Author.id],args = search)
+            return render_template("librarian_specific/all_authors.html",authors = page.items,page = page)
 
         return render_template("librarian_specific/non_existant.html")
 
@@ -515,28 +589,48 @@ def find_something():
 # Tested OK - Gamma
 @app.route("/librarian/book/<id>")
 @librarian_required
+@page_cache.cached
 def see_specific_book(id):
-    book = Book.query.filter(Book.id == id).scalar()
+    book = Book.query.options(*loaders.OBJECT_BOOK).filter(Book.id == id).scalar()
     if not book:
         return render_template('librarian_specific/non_existant.html')
-    return render_template("librarian_specific/object_book.html",book = book)
+    comments_page = book_comments(book.id)
+
+    # Ratings move the aggregates on the book row, which this page does not show.
+    dependencies = (row(book,"name","description") + children(book,"written","category","borrow","requested","comment")
+                    + [d for a in book.authors for d in row(a,"name")]
+                    + [d for s in book.sections for d in row(s,"name")]
+                    + [d for r in book.borrowed + book.requested + comments_page.items for d in row(r.user,"username")])
+    return page_cache.render("librarian_specific/object_book.html",dependencies,book = book,comments_page = comments_page)
+
+# Route to view the file of a particular book.
+@app.route("/librarian/book/<int:id>/content")
+@librarian_required
+def see_book_content(id):
+    src = Content.query.filter(Content.book_id == id).scalar()
+    if not src:
+        return render_template('librarian_specific/non_existant.html')
+    return storage.serve(src.filename)
 
 # Route to view a particular section.
 # Tested OK - Gamma
 @app.route("/librarian/section/<id>")
 @librarian_required
+@page_cache.cached
 def see_specific_section(id):
-    section = Section.query.filter(Section.id == id).scalar()
+    section = Section.query.options(*loaders.SECTION).filter(Section.id == id).scalar()
     if not section:
         return render_template('librarian_specific/non_existant.html')
-    return render_template("librarian_specific/object_section.html",section = section)
+    dependencies = row(section) + children(section,"category") + [d for b in section.books for d in row(b,"name")]
+    return page_cache.render("librarian_specific/object_section.html",dependencies,section = section)
 
 # Route to view a particular user.
 # Tested OK - Gamma
 @app.route("/librarian/user/<id>")
 @librarian_required
+@page_cache.cached
 def see_specific_user(id):
-    user = User.query.filter(User.id == id).scalar()
+    user = User.query.options(*loaders.OBJECT_USER).populate_existing().filter(User.id == id).scalar()
 
     # Librarians cannot interfere with each other.
     if user.is_librarian:
@@ -544,17 +638,22 @@ def see_specific_user(id):
 
     if not user:
         return render_template('librarian_specific/non_existant.html')
-    return render_template("librarian_specific/object_user.html",user = user)
+    loans_of_user = user.borrowed + user.read + user.requested + user.returned + user.comments
+    dependencies = (row(user) + children(user,"borrow","read","requested","return","comment")
+                    + [d for r in loans_of_user for d in row(r.book,"name")])
+    return page_cache.render("librarian_specific/object_user.html",dependencies,user = user)
 
 # Route to view a particular author.
 # Tested OK - Gamma
 @app.route("/librarian/author/<id>")
 @librarian_required
+@page_cache.cached
 def see_specific_author(id):
-    author = Author.query.filter(Author.id == id).scalar()
+    author = Author.query.options(*loaders.AUTHOR).filter(Author.id == id).scalar()
     if not author:
         return render_template('librarian_specific/non_existant.html')
-    return render_template("librarian_specific/object_author.html",author = author)
+    dependencies = row(author) + children(author,"written") + [d for b in author.books for d in row(b,"name")]
+    return page_cache.render("librarian_specific/object_author.html",dependencies,author = author)
 
 # Route to edit the details of some book.
 # Tested OK - Gamma
@@ -579,10 +678,16 @@ def edit_specific_book(id):
             book.description = None
         new_path = form.file_path.data
 
+        # An uploaded file goes to the local store and replaces the address.
+        if form.upload.data:
+            new_path = storage.local().store(form.upload.data.stream,form.upload.data.filename)
+
         # Update content.
         content_obj = Content.query.filter(Content.book_id == id).scalar()
         content_obj.filename = new_path
+        search_index.index(book)
         db.session.commit()
+        leaderboards.invalidate()
 
         return redirect(url_for('see_specific_book',id=id))
 
@@ -604,6 +709,7 @@ def edit_specific_section(id):
             section.description = form.description.data
         else:
             section.description = None
+        search_index.index(section)
         db.session.commit()
 
         return redirect(url_for('see_specific_section',id=id))
@@ -626,6 +732,7 @@ def edit_specific_author(id):
             author.bio = form.description.data
         else:
             author.bio = None
+        search_index.index(author)
         db.session.commit()
 
         return redirect(url_for('see_specific_author',id=id))
@@ -648,10 +755,19 @@ def delete_specific_user(id):
     db.session.query(Return).filter(Return.user_id == id).delete()
     db.session.query(Requested).filter(Requested.user_id == id).delete()
     db.session.query(Comment).filter(Comment.user_id == id).delete()
+
+    # Taking the user's ratings out of the book aggregates before deleting them.
+    score = db.select(Rating.score).where(Rating.book_id == Book.id).where(Rating.user_id == id).scalar_subquery()
+    db.session.query(Book).filter(Book.id.in_(db.select(Rating.book_id).where(Rating.user_id == id))).update(
+        {Book.rating_count: Book.rating_count - 1, Book.rating_total: Book.rating_total - score},
+        synchronize_session = False)
     db.session.query(Rating).filter(Rating.user_id == id).delete()
 
+    search_index.remove(obj)
     db.session.delete(obj)
     db.session.commit()
+    leaderboards.invalidate()
+    user_cache.invalidate(id)
     return redirect(url_for('see_users'))
 
 # Route to delete specific book.
@@ -675,8 +791,10 @@ def delete_specific_book(id):
     db.session.query(Content).filter(Content.book_id == id).delete()
     db.session.query(Rating).filter(Rating.book_id == id).delete()
 
+    search_index.remove(obj)
     db.session.delete(obj)
     db.session.commit()  
+    leaderboards.invalidate()
     return redirect(url_for('see_books'))
 
 # Route to delete specific section.
@@ -691,6 +809,7 @@ def delete_specific_section(id):
     
     db.session.query(category).filter(category.c.section_id == id).delete()
 
+    search_index.remove(obj)
     db.session.delete(obj)
     db.session.commit()   
     return redirect(url_for('see_sections'))
@@ -707,6 +826,7 @@ def delete_specific_author(id):
     
     db.session.query(written).filter(written.c.author_id == id).delete()
 
+    search_index.remove(obj)
     db.session.delete(obj)
     db.session.commit() 
     return redirect(url_for('see_authors'))
@@ -760,6 +880,8 @@ def remove_book_from_user():
         db.session.commit()
     except:
         db.session.rollback()
+    else:
+        recommendations.recommender.add_reads([(user_id,book_id)])
 
     # Rerouting
     origin = request.form.get("origin")
@@ -789,7 +911,7 @@ def add_author_to_book():
         author_name = request.form.get("author_name")
         book_id = request.form.get("book_id")
 
-        author = Author.query.filter(Author.name == author_name).scalar()
+        author = Author.query.filter(Author.slug == slugify(author_name)).scalar()
         if not author:
             return render_template('librarian_specific/non_existant.html')
         
@@ -811,7 +933,7 @@ def add_author_to_book():
         author_id = request.form.get("author_id")
         book_name = request.form.get("book_name")
         
-        book = Book.query.filter(Book.name == book_name).scalar()
+        book = Book.query.filter(Book.slug == slugify(book_name)).scalar()
         if not book:
             return render_template('librarian_specific/non_existant.html')
         
@@ -838,7 +960,7 @@ def add_section_to_book():
         section_name = request.form.get("section_name")
         book_id = request.form.get("book_id")
 
-        section = Section.query.filter(Section.name == section_name).scalar()
+        section = Section.query.filter(Section.slug == slugify(section_name)).scalar()
         if not section:
             return render_template('librarian_specific/non_existant.html')
         
@@ -860,7 +982,7 @@ def add_section_to_book():
         section_id = request.form.get("section_id")
         book_name = request.form.get("book_name")
 
-        book = Book.query.filter(Book.name == book_name).scalar()
+        book = Book.query.filter(Book.slug == slugify(book_name)).scalar()
         if not book:
             return render_template('librarian_specific/non_existant.html')
         
@@ -897,6 +1019,8 @@ def add_item():
 
     try:
         db.session.add(obj)
+        db.session.flush()
+        search_index.index(obj)
         db.session.commit()
 
     except:
@@ -904,8 +1028,9 @@ def add_item():
         return "Duplicates not allowed!"
     
     if kind == "book":
+        leaderboards.invalidate()
         try:
-            db.session.add(Content(book_id = obj.id, filename = "https://drive.google.com/file/d/1a7k6giBy_fBfbH2GwxytDLjnLcVfN5GF/view?usp=sharing"))
+            db.session.add(Content(book_id = obj.id, filename = app.config["PLACEHOLDER_CONTENT"]))
             db.session.commit()
         except:
             db.session.rollback()
@@ -935,6 +1060,49 @@ def grant(id):
     db.session.commit()
     return redirect(url_for("see_requests"))
 
+#Route to grant or reject many requests at once, picked by id and/or by book and age.
+# Takes a form from the requests page or a JSON body, which is answered with the outcome of each request.
+@app.route("/librarian/requests/settle",methods = ["POST"])
+@librarian_required
+def settle_requests():
+    if request.is_json:
+        data = request.get_json(silent = True)
+        if not isinstance(data,dict):
+            return jsonify(error = "Expected a JSON object"),400
+        ids = data.get("ids")
+        # A string would otherwise be taken apart into one id per digit.
+        if ids is not None and (not isinstance(ids,list) or not all(type(i) is int for i in ids)):
+            return jsonify(error = "ids must be a list of integers"),400
+    else:
+        data = request.form
+        ids = data.getlist("ids")
+
+    # Blank fields select nothing.
+    book_id = data.get("book_id") or None
+    older_than = data.get("older_than") or None
+    try:
+        results = loans.settle_requests(data.get("action"),
+                                        ids = [int(i) for i in ids] if ids else None,
+                                        book_id = int(book_id) if book_id is not None else None,
+                                        older_than = int(older_than) if older_than is not None else None)
+    except (ValueError,TypeError) as e:
+        if request.is_json:
+            return jsonify(error = str(e)),400
+        flash(str(e),category="danger")
+        return redirect(url_for("see_requests"))
+
+    if request.is_json:
+        return jsonify(results = {str(id): outcome for id,outcome in results.items()})
+
+    outcomes = list(results.values())
+    for outcome in (loans.GRANTED,loans.ALREADY_BORROWED,loans.REJECTED,loans.NOT_FOUND):
+        if outcome in outcomes:
+            flash(f"{outcomes.count(outcome)} request(s) {outcome}",
+                  category="success" if outcome in (loans.GRANTED,loans.REJECTED) else "warning")
+    if not outcomes:
+        flash("No requests matched",category="warning")
+    return redirect(url_for("see_requests"))
+
 #Route to reject a particular request
 # Tested OK - Gamma
 @app.route("/librarian/reject/<id>")
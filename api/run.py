@@ -1,6 +1,14 @@
+import os
 from api import app,db
+from api import migrations
+from api.tasks import start_scheduler
 
 with app.app_context():
-    db.create_all()
+    migrations.upgrade()
+
+# Background jobs run once the tables are migrated, and only in the process serving
+# requests, not in the flask commands (migrate, seed, export...) that load this module too.
+if os.getenv("FLASK_RUN_FROM_CLI") != "true":
+    start_scheduler(app)
         
 # app.run()
\ No newline at end of file
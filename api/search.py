@@ -0,0 +1,131 @@
+# Imports
+import re
+from api import db
+from api.models import Book,Author,Section,User
+from sqlalchemy import text,table,column,literal_column,false
+
+# Full text index shared by every searchable model. kind and item_id point back at
+# the indexed row, name and body hold the searchable text. Prefix indexes keep
+# "starts with" matching on short terms cheap. FTS5 cannot index kind and item_id, so
+# every entry's rowid is derived from them instead, see _rowid, and entries are
+# replaced and removed by rowid.
+INDEX_DDL = """
+    CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(
+        kind UNINDEXED,
+        item_id UNINDEXED,
+        name,
+        body,
+        tokenize = 'unicode61 remove_diacritics 2',
+        prefix = '2 3'
+    )
+"""
+
+# Matches on the name weigh ten times as much as matches on the body.
+RANK_CONFIG = "INSERT INTO search_index(search_index, rank) VALUES ('rank', 'bm25(0.0, 0.0, 10.0, 1.0)')"
+
+search_index = table("search_index",column("rowid"),column("kind"),column("item_id"),column("name"),column("body"),column("rank"))
+
+# Source column for the name and body of each indexed model.
+FIELDS = {
+    Book: ("name","description"),
+    Author: ("name","bio"),
+    Section: ("name","description"),
+    User: ("username",None),
+}
+
+# Number of each indexed model in rowids, and room for more. Changing either means
+# rebuilding the index.
+CODES = {Book: 0,Author: 1,Section: 2,User: 3}
+SLOTS = 8
+
+def _kind(model):
+    return model.__tablename__
+
+def _rowid(model,id):
+    """Rowid of the entry of the row id of model."""
+    return id * SLOTS + CODES[model]
+
+def ensure_index():
+    """Create the index if it does not exist yet, populating it from the current tables."""
+    exists = db.session.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'search_index'")).scalar()
+    if not exists:
+        db.session.execute(text(INDEX_DDL))
+        db.session.execute(text(RANK_CONFIG))
+        rebuild()
+    db.session.commit()
+
+def rebuild():
+    """Repopulate the whole index with one INSERT ... SELECT per model. Caller commits."""
+    db.session.execute(search_index.delete())
+    for model,(name,body) in FIELDS.items():
+        source = db.select(
+            model.id * SLOTS + CODES[model],
+            literal_column(f"'{_kind(model)}'"),
+            model.id,
+            getattr(model,name),
+            getattr(model,body) if body else literal_column("''"))
+        db.session.execute(search_index.insert().from_select(["rowid","kind","item_id","name","body"],source))
+
+def remove(obj):
+    """Drop the index entry of some object. Caller commits."""
+    db.session.execute(search_index.delete().where(search_index.c.rowid == _rowid(type(obj),obj.id)))
+
+def index(obj):
+    """Add or refresh the index entry of some object. Caller commits."""
+    name,body = FIELDS[type(obj)]
+    remove(obj)
+    db.session.execute(search_index.insert().values(
+        rowid = _rowid(type(obj),obj.id),
+        kind = _kind(type(obj)),
+        item_id = obj.id,
+        name = getattr(obj,name),
+        body = (getattr(obj,body) if body else None) or ""))
+
+def index_many(model,entries):
+    """Add or refresh the entries of many rows of model, given as (id,name,body). Caller commits."""
+    entries = list(entries)
+    if not entries:
+        return
+    db.session.execute(search_index.delete()
+                       .where(search_index.c.rowid.in_([_rowid(model,id) for id,_,_ in entries])))
+    db.session.execute(search_index.insert(),[
+        {"rowid": _rowid(model,id), "kind": _kind(model), "item_id": id, "name": name, "body": body or ""}
+        for id,name,body in entries])
+
+def match_expression(terms):
+    """
+        Turn free text into an FTS5 query where every word must match as a token prefix.
+        Returns None when the text has nothing searchable in it.
+    """
+    tokens = re.findall(r"\w+",terms or "")
+    if not tokens:
+        return None
+    return " ".join(f'"{token}"*' for token in tokens)
+
+def hits(model,terms):
+    """Return a subquery of (item_id,rank) for the objects of some model matching terms."""
+    return (db.select(search_index.c.item_id,search_index.c.rank)
+            .where(literal_column("search_index").op("MATCH")(match_expression(terms)))
+            .where(search_index.c.kind == _kind(model))
+            .subquery())
+
+def ranked_search(model,terms):
+    """
+        Return an unordered query for objects of some model matching terms, along with
+        the rank column to order it by (lower is better).
+    """
+    if match_expression(terms) is None:
+        return model.query.filter(false()),literal_column("0")
+    found = hits(model,terms)
+    return model.query.join(found,found.c.item_id == model.id),found.c.rank
+
+def search(model,terms):
+    """Return a query for objects of some model matching terms, best match first."""
+    query,rank = ranked_search(model,terms)
+    return query.order_by(rank)
+
+def matching_ids(model,terms):
+    """Return a select of ids of objects of some model matching terms, for use in IN filters."""
+    if match_expression(terms) is None:
+        return db.select(model.id).where(false())
+    return db.select(hits(model,terms).c.item_id)
@@ -0,0 +1,126 @@
+# Imports
+import bisect
+import itertools
+import random
+from datetime import datetime,timedelta
+from api import db
+from api import passwords
+from api.models import *
+from api import search,tasks
+from sqlalchemy import insert,func
+
+## Synthetic data generator. Fills the schema with realistically skewed data: a few
+## books and users account for most ratings, comments and loans, as in a real library.
+
+# Password of every generated user.
+PASSWORD = "password"
+# Domain of every seeded user's email.
+EMAIL_DOMAIN = "@example.com"
+
+# Rows per INSERT batch.
+BATCH_SIZE = 10000
+
+ADJECTIVES = ["Silent","Crimson","Hidden","Broken","Golden","Last","Distant","Burning","Frozen","Wandering",
+              "Secret","Hollow","Midnight","Forgotten","Shattered","Endless","Quiet","Wild","Lost","Eternal"]
+NOUNS = ["River","Empire","Garden","Mirror","Crown","Harbour","Forest","Letter","Tide","Kingdom",
+         "Voyage","Shadow","Orchard","Library","Storm","Lantern","Promise","Island","Compass","Archive"]
+FIRST_NAMES = ["Ava","John","Maya","Ravi","Sophia","Liam","Noor","Kenji","Elena","Omar","Priya","Lucas"]
+LAST_NAMES = ["Smith","Das","Wolsher","Lee","Davis","Khan","Rossi","Tanaka","Okafor","Novak","Silva","Iyer"]
+GENRES = ["Fiction","Mystery","Fantasy","Romance","Thriller","Non-Fiction","History","Science","Poetry","Horror"]
+
+class ZipfPicker:
+    """Picks indices in range(n), index i being chosen with weight 1 / (i + 1) ** s."""
+    def __init__(self,n,rng,s = 1.1):
+        self.rng = rng
+        self.cumulative = list(itertools.accumulate(1 / (i + 1) ** s for i in range(n)))
+
+    def __call__(self):
+        return bisect.bisect(self.cumulative,self.rng.random() * self.cumulative[-1])
+
+def _next_id(model):
+    return (db.session.query(func.max(model.id)).scalar() or 0) + 1
+
+def _insert(target,rows,ignore = False,progress = None):
+    """Insert rows from an iterable in batches, optionally skipping duplicate keys."""
+    stmt = insert(target)
+    if ignore:
+        stmt = stmt.prefix_with("OR IGNORE")
+
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == BATCH_SIZE:
+            db.session.execute(stmt,batch)
+            db.session.commit()
+            batch = []
+    if batch:
+        db.session.execute(stmt,batch)
+        db.session.commit()
+
+    if progress:
+        progress(getattr(target,"__tablename__",None) or target.name)
+
+def seed(users,books,authors,sections,ratings,comments,borrows,requests,seed_value = 0,progress = None):
+    """Append generated rows to every table, then refresh aggregates and the search index."""
+    rng = random.Random(seed_value)
+    now = datetime.now()
+
+    first_user,first_book,first_author,first_section = _next_id(User),_next_id(Book),_next_id(Author),_next_id(Section)
+    user_ids = range(first_user,first_user + users)
+    book_ids = range(first_book,first_book + books)
+
+    pick_book = ZipfPicker(books,rng)
+    pick_user = ZipfPicker(users,rng,s = 0.8)
+
+    # Hashing once since bcrypt is deliberately slow.
+    password = passwords.hash_password(PASSWORD)
+    _insert(User,({"id": i, "username": f"user{i}", "email": f"user{i}{EMAIL_DOMAIN}", "password": password,
+                   "doj": now - timedelta(days=rng.randrange(1000)), "is_librarian": 0} for i in user_ids),progress = progress)
+
+    # One librarian to drive the librarian pages with.
+    librarian = first_user + users
+    _insert(User,[{"id": librarian, "username": f"librarian{librarian}", "email": f"librarian{librarian}{EMAIL_DOMAIN}",
+                   "password": password, "doj": now, "is_librarian": 1}])
+
+    _insert(Section,({"id": i, "name": f"{GENRES[i % len(GENRES)]} {i}", "doc": now,
+                      "description": f"Books about {GENRES[i % len(GENRES)].lower()}"}
+                     for i in range(first_section,first_section + sections)),progress = progress)
+
+    _insert(Author,({"id": i, "name": f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)} {i}",
+                     "bio": f"Writes about {rng.choice(NOUNS).lower()}s and {rng.choice(NOUNS).lower()}s"}
+                    for i in range(first_author,first_author + authors)),progress = progress)
+
+    _insert(Book,({"id": i, "name": f"The {rng.choice(ADJECTIVES)} {rng.choice(NOUNS)} {i}",
+                   "description": f"A tale of a {rng.choice(ADJECTIVES).lower()} {rng.choice(NOUNS).lower()}",
+                   "rating_count": 0, "rating_total": 0} for i in book_ids),progress = progress)
+
+    _insert(Content,({"book_id": i, "filename": f"https://example.com/books/{i}.pdf"} for i in book_ids),progress = progress)
+
+    # One to three authors and sections per book.
+    _insert(written,({"book_id": i, "author_id": first_author + rng.randrange(authors)}
+                     for i in book_ids for _ in range(rng.randint(1,3))),ignore = True,progress = progress)
+    _insert(category,({"book_id": i, "section_id": first_section + rng.randrange(sections)}
+                      for i in book_ids for _ in range(rng.randint(1,3))),ignore = True,progress = progress)
+
+    # Ratings lean positive.
+    _insert(Rating,({"book_id": first_book + pick_book(), "user_id": first_user + pick_user(),
+                     "score": rng.choices(range(1,6),weights=[1,2,4,6,4])[0],
+                     "r_date": now - timedelta(days=rng.randrange(90))} for _ in range(ratings)),ignore = True,progress = progress)
+
+    _insert(Comment,({"book_id": first_book + pick_book(), "user_id": first_user + pick_user(),
+                      "content": f"Loved the part about the {rng.choice(NOUNS).lower()}."}
+                     for _ in range(comments)),progress = progress)
+
+    # Borrows spread over two loan periods so some are overdue.
+    _insert(Borrow,({"book_id": first_book + pick_book(), "user_id": first_user + pick_user(),
+                     "b_date": now - timedelta(days=rng.randrange(14))} for _ in range(borrows)),ignore = True,progress = progress)
+    _insert(Read,({"book_id": first_book + pick_book(), "user_id": first_user + pick_user()} for _ in range(borrows)),
+            ignore = True,progress = progress)
+    _insert(Requested,({"book_id": first_book + pick_book(), "user_id": first_user + pick_user(),
+                        "r_date": now - timedelta(days=rng.randrange(30))} for _ in range(requests)),progress = progress)
+
+    tasks.reconcile_rating_aggregates()
+    search.rebuild()
+    db.session.commit()
+    if progress:
+        progress("aggregates and search index")
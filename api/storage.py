@@ -0,0 +1,90 @@
+# Imports
+import hashlib
+import mimetypes
+import os
+import tempfile
+from flask import current_app,redirect,send_file,abort
+
+## Content backends. Content.filename says where the file of a book lives: an http(s)
+## URL is served by redirecting to it, "local:<key>" by the local store. Other backends
+## register themselves under their own scheme.
+
+class RedirectBackend:
+    """Files hosted elsewhere, the reader is sent to their URL."""
+    def serve(self,location):
+        return redirect(location)
+
+class LocalBackend:
+    """
+        Files kept on local disk under CONTENT_ROOT. Stored files are named after the
+        SHA-256 of their bytes, which then doubles as their strong ETag. Responses go
+        through send_file, so Range and conditional requests are handled, and with
+        USE_X_SENDFILE on the front end server sends the bytes itself.
+    """
+    scheme = "local"
+
+    def root(self):
+        return current_app.config["CONTENT_ROOT"]
+
+    def path(self,key):
+        path = os.path.realpath(os.path.join(self.root(),key))
+        # Keys come from the database, still never leaving the store.
+        if os.path.commonpath([path,os.path.realpath(self.root())]) != os.path.realpath(self.root()):
+            abort(404)
+        return path
+
+    def serve(self,key):
+        path = self.path(key)
+        if not os.path.isfile(path):
+            abort(404)
+        digest = os.path.splitext(os.path.basename(key))[0]
+        response = send_file(path,
+                             mimetype = mimetypes.guess_type(path)[0] or "application/octet-stream",
+                             conditional = True,
+                             etag = digest if len(digest) == 64 else True,
+                             max_age = 0)
+        # Only borrowers may read, so shared caches must not keep a copy.
+        response.cache_control.public = False
+        response.cache_control.private = True
+        return response
+
+    def store(self,stream,filename):
+        """Copy a file object into the store and return its location for Content.filename."""
+        os.makedirs(self.root(),exist_ok=True)
+        digest = hashlib.sha256()
+        with tempfile.NamedTemporaryFile(dir=self.root(),delete=False) as f:
+            while True:
+                chunk = stream.read(1 << 20)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                f.write(chunk)
+        key = digest.hexdigest() + os.path.splitext(filename)[1].lower()
+        os.replace(f.name,self.path(key))
+        return f"{self.scheme}:{key}"
+
+    def store_path(self,path):
+        with open(path,"rb") as f:
+            return self.store(f,path)
+
+# Backend of each location scheme.
+BACKENDS = {
+    "http": RedirectBackend(),
+    "https": RedirectBackend(),
+    LocalBackend.scheme: LocalBackend(),
+}
+
+def register(scheme,backend):
+    """Serve locations starting with scheme: through backend."""
+    BACKENDS[scheme] = backend
+
+def local():
+    return BACKENDS[LocalBackend.scheme]
+
+def serve(location):
+    """Return the response delivering the file at location."""
+    scheme,_,rest = location.partition(":")
+    backend = BACKENDS.get(scheme)
+    if backend is None:
+        abort(404)
+    return backend.serve(location if isinstance(backend,RedirectBackend) else rest)
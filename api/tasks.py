@@ -0,0 +1,88 @@
+# Imports
+import threading
+import time
+from datetime import datetime,timedelta
+from flask import current_app
+from api import db
+from api import recommendations
+from api import replica
+from api.models import Book,Borrow,Rating,Read
+from sqlalchemy import insert,delete,func
+
+## Background jobs. Each can be run once from the command line or periodically by the
+## in-process scheduler.
+
+def expire_overdue_borrows(now = None):
+    """
+        Move every overdue borrow to the read table in a single transaction and return
+        how many borrows expired. A borrow is overdue once more than LOAN_DAYS whole
+        days have passed since it was granted.
+    """
+    now = now or datetime.now()
+    cutoff = now - timedelta(days=current_app.config["LOAN_DAYS"] + 1)
+    overdue = db.select(Borrow.book_id,Borrow.user_id).where(Borrow.b_date <= cutoff)
+
+    # Books read before may already have a Read row.
+    fresh = db.session.execute(overdue.where(~db.select(Read).filter_by(book_id=Borrow.book_id,user_id=Borrow.user_id).exists())).all()
+    db.session.execute(insert(Read).prefix_with("OR IGNORE").from_select(["book_id","user_id"],overdue))
+    expired = db.session.execute(delete(Borrow).where(Borrow.b_date <= cutoff)).rowcount
+    db.session.commit()
+    recommendations.recommender.add_reads((user_id,book_id) for book_id,user_id in fresh)
+    return expired
+
+def reconcile_rating_aggregates():
+    """
+        Recompute Book.rating_count and Book.rating_total from the rating table and
+        return how many books had drifted.
+    """
+    count = db.select(func.count(Rating.score)).where(Rating.book_id == Book.id).scalar_subquery()
+    total = db.select(func.coalesce(func.sum(Rating.score),0)).where(Rating.book_id == Book.id).scalar_subquery()
+
+    # Only touching rows that have drifted.
+    drifted = db.session.query(Book).filter((Book.rating_count != count) | (Book.rating_total != total)).update(
+        {Book.rating_count: count, Book.rating_total: total},
+        synchronize_session = False)
+    db.session.commit()
+    return drifted
+
+# Jobs run by the scheduler, as (config key holding the interval in seconds,function).
+JOBS = [
+    ("EXPIRY_INTERVAL",expire_overdue_borrows),
+    ("RECOMMENDATION_INTERVAL",recommendations.rebuild),
+    ("READ_REPLICA_REFRESH",replica.refresh),
+]
+
+# Jobs also run as soon as the worker starts, rather than after their first interval,
+# and retried every RETRY_AT_START seconds until that first run succeeds.
+AT_START = {recommendations.rebuild}
+RETRY_AT_START = 60
+
+# Jobs only started when another config key is set as well.
+REQUIRES = {replica.refresh: "READ_REPLICA_PATH"}
+
+def _run(app,job):
+    """Run job, returning whether it succeeded."""
+    with app.app_context():
+        try:
+            job()
+            return True
+        except Exception:
+            db.session.rollback()
+            app.logger.exception(f"Scheduled job {job.__name__} failed")
+            return False
+
+def _run_periodically(app,interval,job):
+    if job in AT_START:
+        while not _run(app,job):
+            time.sleep(min(interval,RETRY_AT_START))
+    while True:
+        time.sleep(interval)
+        _run(app,job)
+
+def start_scheduler(app):
+    """Start one daemon thread per job whose interval is configured."""
+    for key,job in JOBS:
+        interval = app.config.get(key)
+        if interval and (job not in REQUIRES or app.config.get(REQUIRES[job])):
+            thread = threading.Thread(target=_run_periodically,args=(app,interval,job),name=job.__name__,daemon=True)
+            thread.start()
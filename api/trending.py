@@ -0,0 +1,77 @@
+# Imports
+import time
+from collections import namedtuple
+from datetime import datetime,timedelta
+from flask import g,has_app_context
+from api import app,db
+from api.models import Book,Rating
+from sqlalchemy import func
+
+# Leaderboards are cached as plain tuples since ORM objects are tied to the session
+# that loaded them.
+Entry = namedtuple("Entry",["id","name","rating"])
+
+# Maps (kind,n,days) to (expiry time,entries). days is limited to the configured
+# windows, so the keys are a small fixed set.
+_leaderboards = {}
+# Wall clock time of the last invalidation, for leaderboards read from a replica snapshot.
+_invalidated = 0.0
+
+def windows():
+    """The rating windows a leaderboard may be asked for, None standing for all time."""
+    return {None,app.config["TRENDING_WINDOW_DAYS"],*app.config["TRENDING_WINDOWS"]}
+
+def newest_books(n):
+    """Return the n most recently added books, newest first."""
+    rows = db.session.query(Book.id,Book.name,Book.rating_total,Book.rating_count).order_by(Book.id.desc()).limit(n)
+    return [Entry(id,name,round(total / count,1) if count else 0) for id,name,total,count in rows]
+
+def top_rated_books(n,days = None):
+    """
+        Return the n best rated books. With days set, only ratings given in the last
+        that many days are considered, otherwise the aggregates stored on Book are used.
+    """
+    if days is None:
+        score = Book.rating_total * 1.0 / Book.rating_count
+        rows = (db.session.query(Book.id,Book.name,score)
+                .filter(Book.rating_count > 0)
+                .order_by(score.desc(),Book.rating_count.desc(),Book.id)
+                .limit(n))
+    else:
+        score = func.avg(Rating.score)
+        rows = (db.session.query(Book.id,Book.name,score)
+                .join(Rating,Rating.book_id == Book.id)
+                .filter(Rating.r_date >= datetime.now() - timedelta(days=days))
+                .group_by(Book.id)
+                .order_by(score.desc(),func.count(Rating.score).desc(),Book.id)
+                .limit(n))
+
+    return [Entry(id,name,round(avg,1)) for id,name,avg in rows]
+
+def leaderboard(kind,n,days = None):
+    """Return a cached leaderboard ("newest" or "top"), recomputing it once expired."""
+    if days not in windows():
+        raise ValueError(f"Rating window {days} is not one of TRENDING_WINDOWS")
+    key = (kind,n,days)
+    cached = _leaderboards.get(key)
+    if cached and cached[0] > time.monotonic():
+        return cached[1]
+
+    if kind == "newest":
+        entries = newest_books(n)
+    elif kind == "top":
+        entries = top_rated_books(n,days)
+    else:
+        raise ValueError(f"Unknown leaderboard {kind}")
+
+    # A snapshot taken before the last invalidation misses the change that caused it.
+    snapshot = g.get("read_snapshot") if has_app_context() else None
+    if snapshot is None or snapshot > _invalidated:
+        _leaderboards[key] = (time.monotonic() + app.config["TRENDING_TTL"],entries)
+    return entries
+
+def invalidate():
+    """Drop all cached leaderboards. Called by routes that add, rename, remove or rate books."""
+    global _invalidated
+    _invalidated = time.time()
+    _leaderboards.clear()
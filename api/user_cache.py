@@ -0,0 +1,98 @@
+# Imports
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app
+from api import db
+from api.models import User
+from sqlalchemy import event
+from sqlalchemy.orm import make_transient_to_detached
+from sqlalchemy.orm.util import identity_key
+
+## Cache behind the Flask-Login user loader. Every authenticated request loads its user,
+## so the column values of recently seen users are kept in process for USER_CACHE_TTL
+## seconds, at most USER_CACHE_SIZE of them, least recently used going first.
+
+# Maps user id to (expiry time,column values), guarded by _lock.
+_users = OrderedDict()
+_lock = threading.Lock()
+
+class Counters:
+    """Hits and misses of the cache since startup or the last reset."""
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def ratio(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0
+
+counters = Counters()
+
+def _columns(user):
+    return {attr.key: getattr(user,attr.key) for attr in User.__mapper__.column_attrs}
+
+def _attach(values):
+    """Return the User in the current session for cached column values, without a query."""
+    user = db.session.identity_map.get(identity_key(User,values["id"]))
+    if user is None:
+        user = User(**values)
+        make_transient_to_detached(user)
+        db.session.add(user)
+    return user
+
+def get(user_id):
+    """Return the User with id user_id, from cache when possible, None if there is none."""
+    try:
+        user_id = int(user_id)
+    except (TypeError,ValueError):
+        return None
+
+    config = current_app.config
+    now = time.monotonic()
+    with _lock:
+        cached = _users.get(user_id)
+        if cached and cached[0] > now:
+            _users.move_to_end(user_id)
+            counters.hits += 1
+            values = cached[1]
+        else:
+            counters.misses += 1
+            values = None
+
+    if values is not None:
+        return _attach(values)
+
+    user = User.query.filter_by(id=user_id).first()
+    if user is not None and config["USER_CACHE_SIZE"]:
+        with _lock:
+            _users[user_id] = (now + config["USER_CACHE_TTL"],_columns(user))
+            _users.move_to_end(user_id)
+            while len(_users) > config["USER_CACHE_SIZE"]:
+                _users.popitem(last=False)
+    return user
+
+def invalidate(user_id = None):
+    """Forget one user, or every user when no id is given."""
+    with _lock:
+        if user_id is None:
+            _users.clear()
+        else:
+            _users.pop(int(user_id),None)
+
+def reset():
+    """Empty the cache and zero the counters."""
+    invalidate()
+    with _lock:
+        counters.hits = counters.misses = 0
+
+def size():
+    with _lock:
+        return len(_users)
+
+# Any change to a user made through the ORM drops its cached copy.
+@event.listens_for(User,"after_update")
+@event.listens_for(User,"after_delete")
+def _forget(mapper,connection,target):
+    invalidate(target.id)
@@ -1,2 +1,5 @@
 from api.run import app
-app.run()
\ No newline at end of file
+
+# Guarded, as password hashing processes import this module again when they start.
+if __name__ == "__main__":
+    app.run()